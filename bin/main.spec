@@ -18,7 +18,7 @@ datas = [(join(absolute_path, 'src/main.kv'), '.')]
 binaries = [(join(absolute_path, 'lib/gringo.so'), '.')]
 
 # list of modules to exclude from analysis
-excludes = ['gi', 'Tkinter', '_tkinter', 'twisted', 'pygments', 'pygame', 'matplotlib', 'cv2', 'numpy']
+excludes = ['gi', 'Tkinter', '_tkinter', 'twisted', 'pygments', 'pygame', 'matplotlib', 'cv2']
 
 # list of hiddenimports
 hiddenimports = kivy_deps_all['hiddenimports'] + kivy_factory_modules
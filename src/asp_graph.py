@@ -494,6 +494,22 @@ class GenericWidget(widget.Widget):
                 s = apply_quantifiers(s, existentials, OP.EXISTS)
         return s
 
+    def get_formula_parts(self):
+        """Splits the formula of this level into its conjuncts.
+
+        Returns:
+        A list of (widget, rpn_formula) pairs, one for every child item.
+        Equalities between variables of this level are paired with self.
+        """
+        new_quants, new_eqs = self.get_quantifiers_and_equalities()
+        parts = [(self, eq[0] + '=' + eq[1]) for eq in new_eqs]
+        for ch in self.children:
+            if (isinstance(ch, NexusWidget) or
+                (isinstance(ch, AtomWidget) and ch.is_constant)):
+                continue
+            parts.append((ch, ch.get_formula_RPN(new_quants)))
+        return parts
+
 class Segment:
     """A Segment is an entity that represents a variable.
 
@@ -1430,6 +1446,8 @@ class RootWidget(GenericWidget):
         self.scale_factor = 1
         self.translate_factor = [1, 1]
         self._prev_item = Item.ATOM
+        # Highlighted widgets, {widget: (instructions, update callback)}
+        self._highlights = {}
 
         self.reset_line_canvas()
 
@@ -1529,3 +1547,29 @@ class RootWidget(GenericWidget):
     def highlight_variables(self):
         for l in Line.get_all_lines():
             l.draw_variables()
+
+    def highlight_widgets(self, widgets, color=(1, 0, 0)):
+        """Draws a frame around each widget, following it when it is moved
+        or resized, until clear_highlight is called. The root itself is not
+        framed."""
+        self.clear_highlight()
+        for w in widgets:
+            if (w is None) or (w is self) or (w in self._highlights):
+                continue
+            group = graphics.InstructionGroup()
+            group.add(graphics.Color(*color))
+            frame = graphics.Line(width=2)
+            group.add(frame)
+            def update(w, value, frame=frame):
+                frame.rectangle = (w.x - 4, w.y - 4,
+                                   w.width + 8, w.height + 8)
+            update(w, None)
+            w.bind(pos=update, size=update)
+            w.canvas.after.add(group)
+            self._highlights[w] = (group, update)
+
+    def clear_highlight(self):
+        for w, (group, update) in self._highlights.iteritems():
+            w.unbind(pos=update, size=update)
+            w.canvas.after.remove(group)
+        self._highlights = {}
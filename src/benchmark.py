@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2017 Carlos Pérez Ramil <c.pramil at udc.es>
+
+# This file is part of ASP-Graph.
+
+# ASP-Graph is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# ASP-Graph is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with ASP-Graph.  If not, see <http://www.gnu.org/licenses/>.
+
+"""BENCHMARK SCRIPT
+
+Solves every graph of the example corpus with several solver configurations
+and prints the time needed to enumerate all of their stable models.
+
+With -p the queries are sent to a SolverPool of that many worker
+processes, so several graphs are solved at the same time.
+
+Usage:
+python benchmark.py [-r REPEAT] [-t THREADS] [-p PROCESSES] [FILE_OR_DIR ...]
+"""
+
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+
+# Keep Kivy from parsing the command line arguments of this script
+os.environ['KIVY_NO_ARGS'] = '1'
+
+import main
+import asp_graph as asp
+import solver as eg_solver
+import solver_pool
+from name_manager import NameManager
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+EXAMPLES_DIR = os.path.join(SRC_DIR, '..', 'examples')
+
+def load_rules():
+    """Loads the widget rules of main.kv, leaving out its root widget."""
+    with open(os.path.join(SRC_DIR, 'main.kv'), 'r') as stream:
+        kv = stream.read()
+    kv = kv[:kv.index('# Main window layout')]
+    main.lang.Builder.load_string(kv)
+
+def find_graphs(paths):
+    graphs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, _, filenames in os.walk(path):
+                graphs.extend(os.path.join(dirpath, f)
+                              for f in filenames if f.endswith('.kv'))
+        else:
+            graphs.append(path)
+    return sorted(graphs)
+
+def get_configurations(threads):
+    configs = [{'threads': 1, 'parallel_mode': 'compete',
+                'configuration': 'auto'}]
+    if threads > 1:
+        configs.append({'threads': threads, 'parallel_mode': 'split',
+                        'configuration': 'auto'})
+    for c in eg_solver.Solver.configurations:
+        configs.append({'threads': threads, 'parallel_mode': 'compete',
+                        'configuration': c})
+    return configs
+
+def read_graph(path):
+    nm = NameManager.Instance()
+    nm.clear()
+    asp.Line.clear_lines()
+    register = (lambda name, hooks, is_constant:
+                nm.register(name, asp.Atom(name, hooks, is_constant)))
+    graph = main.load_graph_file(path, register)
+    rpn = graph.get_formula_RPN()
+    rpn = main.norm.LIT.TRUE if rpn == '' else rpn
+    return rpn, graph.get_constants()
+
+def run(rpn, constants, config, repeat):
+    """Returns the number of models and the best time out of repeat runs."""
+    times = []
+    models = 0
+    stdout = sys.stdout
+    for _ in range(repeat):
+        solver = eg_solver.Solver(**config)
+        solver.set_formula(rpn, constants)
+        with open(os.devnull, 'w') as devnull:
+            sys.stdout = devnull
+            try:
+                start = time.time()
+                solver.solve()
+                times.append(time.time() - start)
+            finally:
+                sys.stdout = stdout
+        models = solver.get_model_count()
+    return models, min(times)
+
+def run_pool(pool, jobs, repeat):
+    """Solves the (name, rpn, constants, config) jobs in pool.
+
+    Returns:
+    The number of models and best solving time of every job, or the error
+    """
+    pending = []
+    for name, rpn, constants, config in jobs:
+        pending.append([pool.submit(name, [(None, rpn)], constants, config)
+                        for _ in range(repeat)])
+    results = []
+    for requests in pending:
+        try:
+            for r in requests:
+                r.get()
+        except solver_pool.PoolError as e:
+            results.append(e)
+            continue
+        results.append((requests[0].models_found,
+                        min(r.solve_time for r in requests)))
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('paths', nargs='*', default=[EXAMPLES_DIR])
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('-t', '--threads', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('-p', '--processes', type=int, default=0)
+    args = parser.parse_args()
+
+    load_rules()
+    configs = get_configurations(args.threads)
+    row = '{0:<40} {1:>8} {2:>8} {3:>8} {4:>8} {5:>10}'
+    print row.format('Graph', 'Threads', 'Mode', 'Config', 'Models',
+                     'Time (s)')
+    if args.processes > 0:
+        jobs = []
+        for path in find_graphs(args.paths):
+            try:
+                rpn, constants = read_graph(path)
+            except Exception as e:
+                print 'Skipping {0}: {1}'.format(path, e)
+                continue
+            name = os.path.relpath(path, EXAMPLES_DIR)
+            jobs.extend((name, rpn, constants, c) for c in configs)
+        pool = solver_pool.SolverPool(args.processes)
+        results = run_pool(pool, jobs, args.repeat)
+        pool.close()
+        for (name, _, _, config), result in zip(jobs, results):
+            if isinstance(result, Exception):
+                print 'Skipping {0}: {1}'.format(name, result)
+                continue
+            print row.format(name, config['threads'], config['parallel_mode'],
+                             config['configuration'], result[0],
+                             '{0:.4f}'.format(result[1]))
+        sys.exit(0)
+    for path in find_graphs(args.paths):
+        try:
+            rpn, constants = read_graph(path)
+        except Exception as e:
+            print 'Skipping {0}: {1}'.format(path, e)
+            continue
+        name = os.path.relpath(path, EXAMPLES_DIR)
+        for config in configs:
+            try:
+                models, elapsed = run(rpn, constants, config, args.repeat)
+            except (main.norm.MalformedFormulaError, RuntimeError) as e:
+                print 'Skipping {0}: {1}'.format(path, e)
+                break
+            print row.format(name, config['threads'], config['parallel_mode'],
+                             config['configuration'], models,
+                             '{0:.4f}'.format(elapsed))
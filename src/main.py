@@ -21,6 +21,12 @@ import sys
 import os
 import string
 import re
+import io
+import time
+import Queue
+import threading
+import collections
+import multiprocessing
 
 from kivy.config import Config
 Config.set('graphics', 'width', '1024')
@@ -28,8 +34,12 @@ Config.set('graphics', 'height', '680')
 
 import kivy.app as app
 import kivy.base as base
+import kivy.clock as clock
+import kivy.core.image as core_image
+import kivy.core.text as core_text
 import kivy.core.window as window
 import kivy.graphics as graphics
+import kivy.graphics.transformation as transformation
 import kivy.lang as lang
 import kivy.properties as prop
 import kivy.uix.widget as widget
@@ -43,6 +53,7 @@ import kivy.uix.floatlayout as fl
 import kivy.uix.boxlayout as box
 import kivy.uix.gridlayout as grid
 import kivy.uix.popup as pup
+import kivy.uix.scatter as scatter
 import kivy.animation as anim
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "../lib"))
@@ -50,6 +61,9 @@ sys.path.append(os.path.join(os.path.dirname(__file__), "../lib"))
 import asp_graph as asp
 import normalization as norm
 import solver as eg_solver
+import solver_pool
+import solve_cache
+import model_export
 import tutorial
 from name_manager import NameManager, NameParser
 
@@ -68,6 +82,70 @@ if DEBUG:
     from pympler import refbrowser
     from pympler.classtracker import ClassTracker
 
+def load_graph_file(filename, register_atom):
+    """Builds the graph stored in a saved .kv file.
+
+    Arguments:
+    filename: Path of the file
+    register_atom: Callable used to register every atom name found in the
+    file, with the same signature as GlobalContainer.register_atom
+    Returns:
+    The RootWidget of the loaded graph
+    """
+    # Temporal line storage. Its contents are arranged as follows:
+    # { line_id: (graph, hook_list) , ... }
+    lines = {}
+    with open(filename, 'r') as stream:
+        for line in stream:
+            if line.startswith(NameParser.TOKENS['name']):
+                name, hooks, is_constant = NameParser.parse_name(line)
+                register_atom(name, hooks, is_constant)
+            if line.startswith(NameParser.TOKENS['line']):
+                line_id, graph = NameParser.parse_line(line)
+                lines[line_id] = (graph, [None] * len(graph))
+
+    new_graph = lang.Builder.load_file(filename)
+    for w in new_graph.walk(restrict=True):
+        if isinstance(w, asp.AtomWidget):
+            w._deferred_init()
+            for i in w.get_line_info():
+                line_id = i[0]
+                hook_index = i[1]
+                lines[line_id][1][hook_index] = i[2]
+        elif isinstance(w, asp.NexusWidget):
+            for i in w.line_info:
+                line_id = i[0]
+                hook_index = i[1]
+                lines[line_id][1][hook_index] = w
+
+    for line, info in lines.iteritems():
+        print line, info
+        asp.Line.build_from_graph(info[0], info[1])
+    return new_graph
+
+def get_signatures(predicates):
+    """Returns the (name, arity) signatures of a comma separated list of
+    predicate names registered at the NameManager."""
+    nm = NameManager.Instance()
+    pred_list = [p.strip() for p in predicates.split(',')]
+    return [(p, nm.get(p).hook_points.count(True)) for p in pred_list]
+
+def load_texture(data):
+    """Decodes PNG image data into a texture, without temporary files."""
+    return core_image.Image(io.BytesIO(data), ext='png').texture
+
+def load_text_texture(text, width=1000, max_lines=200):
+    """Renders text into a texture, wrapped to width pixels. Lines past
+    max_lines are left out."""
+    lines = text.split('\n')
+    if len(lines) > max_lines:
+        more = len(lines) - max_lines
+        lines = lines[:max_lines] + ['... {0} more'.format(more)]
+    label = core_text.Label(text='\n'.join(lines), font_size=14,
+                            text_size=(width, None))
+    label.refresh()
+    return label.texture
+
 class HoverBehavior(object):
 
     hovered = prop.BooleanProperty(False)
@@ -190,36 +268,342 @@ class ExportDialog(fl.FloatLayout):
     text_input = prop.ObjectProperty(None)
     cancel = prop.ObjectProperty(None)
 
+class GraphRenderCache(object):
+    """LRU cache of the graph textures of the models of a solver.
+
+    A background thread renders the models requested with prefetch(); its
+    PNG data is turned into a texture when the model is shown, since
+    textures can only be created in the main thread.
+    """
+
+    def __init__(self, solver, capacity=16):
+        self.solver = solver
+        self.capacity = capacity
+        self._textures = collections.OrderedDict()
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._layouts = collections.OrderedDict()
+        # Layout engine and time of the last texture
+        self.info = None
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='render')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def get_key(self, index, generation=None):
+        solver = self.solver
+        # Consequences are refined in place, their model 0 changes
+        found = solver.models_found if solver.is_consequences() else 0
+        # A stable layout moves its nodes when new ones are laid out
+        if not solver.stable_layout:
+            generation = None
+        elif generation is None:
+            generation = solver.layout_generation
+        return (index, found, tuple(sorted(solver.show)),
+                solver.stable_layout, solver.layout_engine, generation)
+
+    def get_texture(self, index):
+        key = self.get_key(index)
+        entry = self._textures.pop(key, None)
+        if entry is None:
+            with self._lock:
+                rendered = self._data.pop(key, None)
+            if rendered is None:
+                rendered = self.solver.render_graph(index)
+            data, engine, elapsed, generation = rendered
+            key = self.get_key(index, generation)
+            if data is None:
+                texture = load_text_texture(self.solver.get_model_table(index))
+            else:
+                texture = load_texture(data)
+            entry = (texture, (engine, elapsed))
+        self._textures[key] = entry
+        texture, self.info = entry
+        while len(self._textures) > self.capacity:
+            self._textures.popitem(last=False)
+        return texture
+
+    def get_layout(self, index):
+        """Returns the nodes and edges of the model at index, laid out."""
+        key = self.get_key(index)
+        entry = self._layouts.pop(key, None)
+        if entry is None:
+            start = time.time()
+            nodes, edges, engine, generation = self.solver.layout_model(index)
+            entry = (nodes, edges, (engine, time.time() - start))
+            key = self.get_key(index, generation)
+        self._layouts[key] = entry
+        self.info = entry[2]
+        while len(self._layouts) > self.capacity:
+            self._layouts.popitem(last=False)
+        return entry[0], entry[1]
+
+    def prefetch(self, indices):
+        for index in indices:
+            self._queue.put(index)
+
+    def close(self):
+        self._queue.put(None)
+
+    def _run(self):
+        for index in iter(self._queue.get, None):
+            if not 0 <= index < self.solver.get_model_count():
+                continue
+            key = self.get_key(index)
+            if (key in self._textures) or (key in self._data):
+                continue
+            rendered = self.solver.render_graph(index)
+            key = self.get_key(index, rendered[3])
+            with self._lock:
+                self._data[key] = rendered
+                while len(self._data) > self.capacity:
+                    self._data.popitem(last=False)
+
+class ModelGraphView(scatter.Scatter):
+    """Draws a model graph with canvas instructions, from the positions of
+    Solver.layout_model. Zooming and panning only change the transformation
+    of the scatter, the graph is not laid out or drawn again."""
+
+    # Textures of the node labels, shared by every view
+    labels = {}
+    # Vertices of a Mesh are indexed with unsigned shorts
+    max_mesh_edges = 30000
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('do_rotation', False)
+        kwargs.setdefault('auto_bring_to_front', False)
+        super(ModelGraphView, self).__init__(**kwargs)
+
+    @classmethod
+    def get_label(cls, text):
+        texture = cls.labels.get(text)
+        if texture is None:
+            label = core_text.Label(text=text, font_size=16)
+            label.refresh()
+            texture = cls.labels[text] = label.texture
+        return texture
+
+    def set_graph(self, nodes, edges):
+        """Draws nodes, as returned by Solver.layout_model, and edges."""
+        self.canvas.clear()
+        if not nodes:
+            return
+        xs = [pos[0] for pos, _ in nodes.itervalues()]
+        ys = [pos[1] for pos, _ in nodes.itervalues()]
+        x0, y0 = min(xs) - 40, min(ys) - 20
+        with self.canvas:
+            # Edges are batched into a few line meshes
+            graphics.Color(.6, .6, .6, 1)
+            for i in range(0, len(edges), self.max_mesh_edges):
+                vertices = []
+                for a, b in edges[i:i + self.max_mesh_edges]:
+                    (xa, ya), _ = nodes[a]
+                    (xb, yb), _ = nodes[b]
+                    vertices.extend([xa - x0, ya - y0, 0, 0,
+                                     xb - x0, yb - y0, 0, 0])
+                graphics.Mesh(vertices=vertices, mode='lines',
+                              indices=range(len(vertices) // 4))
+            graphics.Color(1, 1, 1, 1)
+            for (x, y), label in nodes.itervalues():
+                texture = self.get_label(label)
+                w, h = texture.size
+                graphics.Rectangle(texture=texture, size=texture.size,
+                                   pos=(x - x0 - w / 2.0, y - y0 - h / 2.0))
+        self.size = (max(xs) - x0 + 40, max(ys) - y0 + 20)
+
+    def fit(self, size):
+        """Scales and centers the graph in an area of the given size."""
+        scale = min(size[0] / self.width, size[1] / self.height, 1.0)
+        self.transform = transformation.Matrix()
+        self.apply_transform(transformation.Matrix().scale(scale, scale, 1))
+        self.pos = ((size[0] - self.width * scale) / 2.0,
+                    (size[1] - self.height * scale) / 2.0)
+
 class StableModelDialog(fl.FloatLayout):
     cancel = prop.ObjectProperty(None)
 
     def __init__(self, solver, **kwargs):
         super(StableModelDialog, self).__init__(**kwargs)
         self.solver = solver
+        self.renderer = GraphRenderCache(solver)
+        self.graph_view = None
         self.index = 0
-        number = [str(self.index+1), str(len(self.solver.get_models()))]
-        self.ids.number.text = '/'.join(number)
+        if solver.stable_layout:
+            self.ids.stable_layout.state = 'down'
+        self.ids.layout_engine.values = eg_solver.Solver.layout_engines
+        self.ids.layout_engine.text = solver.layout_engine
+        self.models_shown = solver.models_found
+        self.update_number()
+        if self.solver.is_running():
+            clock.Clock.schedule_interval(self.update_number, 0.2)
+
+    def update_number(self, *args):
+        running = self.solver.is_running()
+        more = '' if self.solver.is_exhausted() else '+'
+        if self.solver.is_consequences():
+            # A single summary graph, redrawn when clingo refines it
+            found = self.solver.models_found
+            self.ids.number.text = '{0} ({1}{2} models)'.format(
+                self.solver.enum_mode.capitalize(), found, more)
+            if found != self.models_shown:
+                self.models_shown = found
+                self.show_model(0)
+        else:
+            count = self.solver.get_model_count()
+            number = [str(self.index+1), str(count)]
+            self.ids.number.text = '/'.join(number) + more
+        throughput = self.solver.get_throughput()
+        if (not running) and (throughput is not None):
+            self.ids.number.text += ' ({0:.0f} models/s)'.format(throughput)
+        if self.renderer.info is not None:
+            self.ids.number.text += ' - {0}, {1:.2f} s'.format(
+                *self.renderer.info)
+        self.ids.stop.disabled = not running
+        if not running:
+            clock.Clock.unschedule(self.update_number)
+            return False
+
+    def set_predicates(self, predicates):
+        # Output projection is applied on the stored models, no new
+        # grounding or solving is needed
+        try:
+            signatures = get_signatures(predicates) if predicates else []
+        except Exception:
+            return
+        self.solver.set_show(signatures)
+        self.show_model(self.index)
+
+    def show_model(self, index):
+        """Draws the graph of the model at index, and renders the ones next
+        to it in the background."""
+        if self.graph_view is not None:
+            self.graph_view.set_graph(*self.renderer.get_layout(index))
+            self.graph_view.fit(self.ids.view.size)
+            return
+        self.ids.img.texture = self.renderer.get_texture(index)
+        if not self.solver.is_consequences():
+            self.renderer.prefetch([index + 1, index - 1])
+
+    def set_stable_layout(self, stable):
+        """Keeps the nodes of every model in place (see Solver.stable_layout)
+        or lays out each model on its own."""
+        self.solver.stable_layout = stable
+        self.show_model(self.index)
+        self.update_number()
+
+    def find_models(self, query):
+        """Jumps to the next enumerated model matching query (see
+        Solver.find_models), and shows how many models match."""
+        if not query.strip():
+            self.ids.matches.text = ''
+            return
+        try:
+            matches = self.solver.find_models(query)
+        except RuntimeError:
+            self.ids.matches.text = 'Invalid query'
+            return
+        self.ids.matches.text = '{0} found'.format(len(matches))
+        following = [i for i in matches if i > self.index] or matches
+        if following:
+            self.index = following[0]
+            self.show_model(self.index)
+            self.update_number()
+
+    def show_statistics(self):
+        """Shows how often each atom holds in the enumerated models."""
+        stats = self.solver.get_atom_statistics()
+        n = max(stats['models'], 1)
+        def atoms(symbols, limit=20):
+            text = ' '.join(str(s) for s in symbols[:limit])
+            if len(symbols) > limit:
+                text += ' ... ({0} more)'.format(len(symbols) - limit)
+            return text or '-'
+        lines = ['{0} models{1}'.format(
+                     stats['models'],
+                     '' if self.solver.is_exhausted() else ' (so far)'),
+                 'Always true: ' + atoms(stats['always']),
+                 'Never true: ' + atoms(stats['never']),
+                 'Frequencies:']
+        lines.extend('    {0}: {1:.1f}%'.format(s, 100.0 * c / n)
+                     for s, c in stats['frequencies'][:20])
+        if self.solver.show:
+            lines.append('Always together: ' + atoms(
+                ['{0} & {1}'.format(*pair) for pair in stats['together']]))
+        else:
+            lines.append('Enter output predicates to compare pairs of atoms')
+        popup = pup.Popup(title='Atom statistics', size_hint=(0.7, 0.8))
+        popup.content = ErrorDialog('\n'.join(lines), cancel=popup.dismiss)
+        popup.open()
+
+    def set_native_view(self, native):
+        """Draws the graphs with Kivy instead of Graphviz images, so they
+        can be zoomed and panned."""
+        view = self.ids.view
+        if native and self.graph_view is None:
+            view.remove_widget(self.ids.img)
+            self.graph_view = ModelGraphView()
+            view.add_widget(self.graph_view)
+        elif not native and self.graph_view is not None:
+            view.remove_widget(self.graph_view)
+            self.graph_view = None
+            view.add_widget(self.ids.img)
+        self.show_model(self.index)
+        self.update_number()
+
+    def set_layout_engine(self, engine):
+        self.solver.layout_engine = engine
+        self.show_model(self.index)
+        self.update_number()
+
+    def stop(self):
+        self.solver.stop()
+
+    def close(self):
+        clock.Clock.unschedule(self.update_number)
+        self.renderer.close()
+        self.solver.stop()
+        self.cancel()
 
     def previous_model(self):
         if self.index < 1:
             return
         self.index -= 1
-        model = self.solver.get_models()[self.index]
-        self.solver.generate_graph(model)
-        self.ids.img.reload()
-        number = [str(self.index+1), str(len(self.solver.get_models()))]
-        self.ids.number.text = '/'.join(number)
+        self.show_model(self.index)
+        self.update_number()
 
     def next_model(self):
+        # Models are enumerated on demand, keep the solver a few models
+        # ahead of the one being shown.
+        self.solver.request_model(self.index + 1)
         models = self.solver.get_models()
         if self.index > (len(models) - 2):
             return
         self.index += 1
-        model = models[self.index]
-        self.solver.generate_graph(model)
-        self.ids.img.reload()
-        number = [str(self.index+1), str(len(models))]
-        self.ids.number.text = '/'.join(number)
+        self.show_model(self.index)
+        self.update_number()
+
+class SolverSettingsDialog(fl.FloatLayout):
+    validate_callback = prop.ObjectProperty(None)
+    cancel = prop.ObjectProperty(None)
+
+    def __init__(self, settings, validate_callback=None, **kwargs):
+        super(SolverSettingsDialog, self).__init__(**kwargs)
+        self.validate_callback = validate_callback
+        threads = range(1, multiprocessing.cpu_count() + 1)
+        self.ids.threads.values = [str(i) for i in threads]
+        self.ids.threads.text = str(settings['threads'])
+        self.ids.parallel_mode.values = eg_solver.Solver.parallel_modes
+        self.ids.parallel_mode.text = settings['parallel_mode']
+        self.ids.configuration.values = eg_solver.Solver.configurations
+        self.ids.configuration.text = settings['configuration']
+        self.ids.enum_mode.values = eg_solver.Solver.enum_modes
+        self.ids.enum_mode.text = settings['enum_mode']
+
+    def get_settings(self):
+        return {'threads': int(self.ids.threads.text),
+                'parallel_mode': self.ids.parallel_mode.text,
+                'configuration': self.ids.configuration.text,
+                'enum_mode': self.ids.enum_mode.text}
 
 class ErrorDialog(fl.FloatLayout):
     cancel = prop.ObjectProperty(None)
@@ -228,6 +612,28 @@ class ErrorDialog(fl.FloatLayout):
         super(ErrorDialog, self).__init__(**kwargs)
         self.ids.label.text = str_err
 
+class ProgressDialog(fl.FloatLayout):
+    """Shows how many models a running solver, or a request of the solver
+    pool, has found, twice a second, with a button to stop it."""
+    stop = prop.ObjectProperty(None)
+
+    def __init__(self, solver, text='{0} stable models', **kwargs):
+        super(ProgressDialog, self).__init__(**kwargs)
+        self.solver = solver
+        self.text = text
+        self.start = time.time()
+        self.event = clock.Clock.schedule_interval(self.update, 0.5)
+        self.update()
+
+    def update(self, *args):
+        found = self.solver.models_found
+        elapsed = time.time() - self.start
+        self.ids.label.text = '{0}\n{1:.0f} models/s'.format(
+            self.text.format(found), found / elapsed if elapsed else 0)
+
+    def close(self):
+        self.event.cancel()
+
 class AboutDialog(fl.FloatLayout):
     cancel = prop.ObjectProperty(None)
 
@@ -431,7 +837,10 @@ class AtomNameInput(txt.TextInput):
 
 class AtomEditor(box.BoxLayout):
 
-    def update(self, atom):
+    # What-if values, by the text shown in the spinner
+    assumption_values = {'free': None, 'true': True, 'false': False}
+
+    def update(self, atom, assumption=None):
         states = {True: 'down', False: 'normal'}
         self.ids.hook_label.text = atom.name
         self.ids.hook_left.state = states[atom.hook_points[0]]
@@ -439,6 +848,15 @@ class AtomEditor(box.BoxLayout):
         self.ids.hook_top.state = states[atom.hook_points[2]]
         self.ids.hook_bottom.state = states[atom.hook_points[3]]
         self.ids.constant_checkbox.state = states[atom.is_constant]
+        # Only propositional atoms can be assumed
+        self.ids.whatif.disabled = any(atom.hook_points) or atom.is_constant
+        for text, value in self.assumption_values.iteritems():
+            if value == assumption:
+                self.ids.whatif.text = text
+
+    def update_assumption(self, text):
+        self.root.set_assumption(self.ids.hook_label.text,
+                                 self.assumption_values[text])
 
     def update_atom(self):
         is_constant = self.ids.constant_checkbox.state == 'down'
@@ -472,6 +890,27 @@ class GlobalContainer(box.BoxLayout):
         self.working_dir = './'
         self.tutorial = None
         self.popup_stack = []
+        self.solver_settings = {'threads': 1,
+                                'parallel_mode': 'compete',
+                                'configuration': 'auto',
+                                'enum_mode': 'all'}
+        cache_dir = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'asp-graph')
+        self.solve_cache = solve_cache.SolveCache(spill_dir=cache_dir)
+        # Solver sessions, one for each open graph
+        self.sessions = {}
+        # SolverPool for the queries that show no models, started on the
+        # first one. Its workers are daemons, they end with the application.
+        self.pool = None
+        # Files of the loaded or saved graphs
+        self.documents = {}
+        # What-if assumptions on propositional atoms, {name: bool}
+        self.assumptions = {}
+        self.last_predicates = None
+        # ProgressDialog popup of a running count
+        self.progress = None
+        # Number of the last query, callbacks of older ones are dropped
+        self.query_generation = 0
         window.Window.bind(on_resize=self.on_resize)
 
         if DEBUG:
@@ -576,7 +1015,19 @@ class GlobalContainer(box.BoxLayout):
             if editor.disabled:
                 editor.disabled = False
             atom = self.name_manager.get(name)
-            editor.update(atom)
+            editor.update(atom, self.assumptions.get(name))
+
+    def set_assumption(self, name, value):
+        """Fixes (or frees, if value is None) a propositional atom and shows
+        the stable models again if they were already requested."""
+        if self.assumptions.get(name) == value:
+            return
+        if value is None:
+            self.assumptions.pop(name)
+        else:
+            self.assumptions[name] = value
+        if self.last_predicates is not None:
+            self.run_query(self.last_predicates)
 
     def update_atom(self, name, new_name='', new_hook_points=[], is_constant=False):
         atom = self.name_manager.get(name)
@@ -648,6 +1099,8 @@ class GlobalContainer(box.BoxLayout):
                 return
             selected_button.text = new_name
             atom.name = new_name
+            if old_name in self.assumptions:
+                self.assumptions[new_name] = self.assumptions.pop(old_name)
             self.name_manager.unregister(old_name)
             self.name_manager.register(new_name, atom)
             self.update_atom_editor(new_name)
@@ -655,6 +1108,7 @@ class GlobalContainer(box.BoxLayout):
     def delete_atom(self):
         for button in self.ids.name_list.children:
             if button.state == 'down':
+                self.assumptions.pop(button.text, None)
                 self.name_manager.unregister(button.text)
                 self.active_graph.delete_atom(button.text)
                 asp.AtomWidget.active_atom = None
@@ -664,6 +1118,8 @@ class GlobalContainer(box.BoxLayout):
     def clear_atoms(self):
         self.ids.name_list.clear_widgets()
         self.name_manager.clear()
+        self.assumptions = {}
+        self.last_predicates = None
         self.update_atom_editor('')
         asp.AtomWidget.active_atom = None
 
@@ -671,6 +1127,8 @@ class GlobalContainer(box.BoxLayout):
         # TODO: Migrate to tab system
         asp.Line.clear_lines()
         self.clear_atoms()
+        self.drop_session(self.active_graph)
+        self.documents.pop(self.active_graph, None)
         if self.active_graph is None:
             g = asp.RootWidget()
             self.graph_list.append(g)
@@ -681,6 +1139,8 @@ class GlobalContainer(box.BoxLayout):
 
     def close_graph(self):
         if self.active_graph is not None:
+            self.drop_session(self.active_graph)
+            self.documents.pop(self.active_graph, None)
             asp.Line.clear_lines()
             self.active_graph.delete_tree()
             self.active_graph.delete_root()
@@ -723,6 +1183,20 @@ class GlobalContainer(box.BoxLayout):
         popup = self.popup_stack.pop()
         popup.dismiss()
 
+    def show_progress(self, solver, title, text='{0} stable models'):
+        """Opens a ProgressDialog of solver, closed by close_progress."""
+        content = ProgressDialog(solver, text=text, stop=solver.stop)
+        p = CustomPopup(self, title=title, content=content,
+                        size_hint=(0.4, 0.4))
+        self.push_popup(p)
+        return p
+
+    def close_progress(self, popup):
+        popup.content.close()
+        if popup in self.popup_stack:
+            self.popup_stack.remove(popup)
+            popup.dismiss()
+
     def show_rename_atom(self):
         content = TextInputDialog(caption="Enter new name",
                                   validate_callback=self.rename_atom,
@@ -763,25 +1237,185 @@ class GlobalContainer(box.BoxLayout):
                         size_hint=(0.4, 0.25))
         self.push_popup(p)
 
+    def show_check_interpretation(self):
+        caption = "Enter the atoms of the interpretation"
+        content = TextInputDialog(caption=caption,
+                                  validate_callback=self.check_interpretation,
+                                  dismiss_on_validate=False,
+                                  cancel=self.dismiss_popup)
+        p = CustomPopup(self, title="Check interpretation", content=content,
+                        size_hint=(0.4, 0.25))
+        self.push_popup(p)
+
+    def check_interpretation(self, atoms):
+        """Tells whether atoms are a stable model of the active graph."""
+        self.dismiss_popup()
+
+        def on_finish(pending):
+            if pending.error is not None:
+                self.show_error(pending.error)
+                return
+            text = ('Stable model' if pending.result else
+                    'Not a stable model')
+            self.show_message('Check interpretation', text)
+        self.submit_query(self.solver_settings, query='check',
+                          argument=atoms, on_finish=on_finish)
+
+    def submit_query(self, settings, show=[], query='solve', argument=None,
+                     on_finish=None):
+        """Sends a query on the active graph to the solver pool, which
+        runs it in another process.
+
+        Arguments:
+        settings: Keyword arguments of the Solver
+        show, query, argument: As in SolverPool.submit
+        on_finish: Callable invoked on the main loop with the PoolResult
+        when the query ends
+        Returns:
+        The PoolResult, or None if the query was not sent
+        """
+        try:
+            # Tags are diagram elements, they do not leave this process
+            parts = [(None, rpn)
+                     for _, rpn in self.active_graph.get_formula_parts()]
+            for _, rpn in parts:
+                norm.Formula(rpn)
+        except norm.MalformedFormulaError:
+            self.show_error('Malformed formula.')
+            return None
+        if self.pool is None:
+            self.pool = solver_pool.SolverPool(processes=2)
+
+        def callback(pending):
+            clock.Clock.schedule_once(lambda dt: on_finish(pending))
+        try:
+            return self.pool.submit(
+                id(self.active_graph), parts,
+                self.active_graph.get_constants(), settings=settings,
+                assumptions=self.assumptions, show=show, block=False,
+                query=query, argument=argument, callback=callback)
+        except Queue.Full:
+            self.show_error('Too many queries running.')
+            return None
+
+    def drop_session(self, graph):
+        """Forgets the solver session of graph, stopping its query, which
+        may be paused waiting for more models to be requested."""
+        solver = self.sessions.pop(graph, None)
+        if solver is not None:
+            solver.stop()
+
+    def get_solver(self):
+        """Returns the solver session of the active graph, which keeps the
+        grounded program between queries."""
+        solver = self.sessions.get(self.active_graph)
+        settings = None
+        if solver is not None:
+            settings = solver.get_settings()
+        if settings != self.solver_settings:
+            self.drop_session(self.active_graph)
+            solver = eg_solver.Solver(cache=self.solve_cache,
+                                      **self.solver_settings)
+            self.sessions[self.active_graph] = solver
+        solver.set_document(self.documents.get(self.active_graph))
+        return solver
+
+    def show_solver_settings(self):
+        content = SolverSettingsDialog(
+            self.solver_settings, validate_callback=self.set_solver_settings,
+            cancel=self.dismiss_popup)
+        p = CustomPopup(self, title="Solver settings", content=content,
+                        size_hint=(0.4, 0.4))
+        self.push_popup(p)
+
+    def show_solver_statistics(self):
+        solver = self.sessions.get(self.active_graph)
+        if (solver is None) or (solver.result.status == 'Undefined'):
+            self.show_error('No query has been solved in this graph.')
+            return
+        content = ErrorDialog(solver.result.format(),
+                              cancel=self.dismiss_popup)
+        p = CustomPopup(self, title="Solver statistics", content=content,
+                        size_hint=(0.5, 0.7))
+        self.push_popup(p)
+
+    def show_grounding_hot_spots(self):
+        """Grounds the formula of the active graph, counting the ground rules
+        of each of its top level items, and shows them in a ranking."""
+        solver = self.get_solver()
+        try:
+            solver.set_parts(self.active_graph.get_formula_parts(),
+                             self.active_graph.get_constants())
+        except norm.MalformedFormulaError:
+            self.show_error('Malformed formula.')
+            return
+
+        def on_finish(solver, spots, error):
+            if error is not None:
+                error = str(error)
+                clock.Clock.schedule_once(lambda dt: self.show_error(error))
+                return
+            clock.Clock.schedule_once(
+                lambda dt: self.show_hot_spots_report(spots))
+        solver.run_async(solver.get_grounding_hot_spots, on_finish)
+
+    def show_hot_spots_report(self, spots):
+        lines = []
+        for i, (tags, rules, atoms) in enumerate(spots[:10]):
+            names = []
+            for tag in tags:
+                formula = tag.get_formula() if tag is not None else ''
+                if len(formula) > 40:
+                    formula = formula[:37] + '...'
+                names.append('{0} {1}'.format(type(tag).__name__, formula))
+            lines.append('{0}. {1}: {2} rules, {3} atoms'.format(
+                i + 1, ', '.join(names), rules, atoms))
+        print 80 * '-'
+        print 'Grounding hot spots:'
+        print '\n'.join(lines)
+        content = ErrorDialog('\n'.join(lines) or 'Empty program',
+                              cancel=self.dismiss_popup)
+        p = CustomPopup(self, title="Grounding hot spots", content=content,
+                        size_hint=(0.8, 0.7))
+        self.push_popup(p)
+
+    def set_solver_settings(self, settings):
+        self.solver_settings = settings
+        self.dismiss_popup()
+
     def show_stable_models(self, solver):
         models = solver.get_models()
         content = None
         if len(models) == 0:
             content = ErrorDialog('Unsatisfiable', cancel=self.dismiss_popup)
         else:
-            solver.generate_graph(models[0])
             content = StableModelDialog(solver, cancel=self.dismiss_popup)
-            content.ids.img.reload()
-        p = CustomPopup(self, catch_keyboard=False, title="Stable Models",
+            content.show_model(0)
+        p = CustomPopup(self, title="Stable Models",
                         content=content, size_hint=(0.9, 0.9))
         self.push_popup(p)
 
+    def show_model_count(self, pending):
+        text = '{0}{1} stable models\n{2:.0f} models/s'.format(
+            pending.models_found, '' if pending.is_exhausted() else '+',
+            pending.get_throughput() or 0)
+        content = ErrorDialog(text, cancel=self.dismiss_popup)
+        p = CustomPopup(self, title="Stable Models", content=content,
+                        size_hint=(0.4, 0.4))
+        self.push_popup(p)
+
     def show_error(self, err_str):
         content = ErrorDialog(err_str, cancel=self.dismiss_popup)
         p = CustomPopup(self, catch_keyboard=False, title="Error",
                         content=content, size_hint=(0.4, 0.3))
         self.push_popup(p)
 
+    def show_message(self, title, text):
+        content = ErrorDialog(text, cancel=self.dismiss_popup)
+        p = CustomPopup(self, catch_keyboard=False, title=title,
+                        content=content, size_hint=(0.4, 0.3))
+        self.push_popup(p)
+
     def show_about(self):
         content = AboutDialog(cancel=self.dismiss_popup)
         p = CustomPopup(self, catch_keyboard=False, title="About "+__title__,
@@ -794,39 +1428,12 @@ class GlobalContainer(box.BoxLayout):
 
         try:
             f = os.path.join(path, filename[0])
-            # Temporal line storage. Its contents are arranged as follows:
-            # { line_id: (graph, hook_list) , ... }
-            lines = {}
-            with open(f, 'r') as stream:
-                for line in stream:
-                    if line.startswith(NameParser.TOKENS['name']):
-                        name, hooks, is_constant = NameParser.parse_name(line)
-                        self.register_atom(name, hooks, is_constant)
-                    if line.startswith(NameParser.TOKENS['line']):
-                        line_id, graph = NameParser.parse_line(line)
-                        lines[line_id] = (graph, [None] * len(graph))
-
-            new_graph = lang.Builder.load_file(f)
+            new_graph = load_graph_file(f, self.register_atom)
             self.ids.stencilview.add_widget(new_graph)
             self.active_graph = new_graph
+            self.documents[new_graph] = os.path.abspath(f)
             #self.graph_list.pop()
             self.graph_list.append(new_graph)
-            for w in self.active_graph.walk(restrict=True):
-                if isinstance(w, asp.AtomWidget):
-                    w._deferred_init()
-                    for i in w.get_line_info():
-                        line_id = i[0]
-                        hook_index = i[1]
-                        lines[line_id][1][hook_index] = i[2]
-                elif isinstance(w, asp.NexusWidget):
-                    for i in w.line_info:
-                        line_id = i[0]
-                        hook_index = i[1]
-                        lines[line_id][1][hook_index] = w
-
-            for line, info in lines.iteritems():
-                print line, info
-                asp.Line.build_from_graph(info[0], info[1])
 
             self.set_mode(self.modestr)
             self.set_item(self.itemstr)
@@ -841,6 +1448,8 @@ class GlobalContainer(box.BoxLayout):
 
     def save(self, path, filename):
         self.working_dir = path
+        self.documents[self.active_graph] = os.path.abspath(
+            os.path.join(path, filename))
         with open(os.path.join(path, filename), 'w') as stream:
             stream.write('#:kivy 1.0.9\n\n')
             for (name, atom) in self.name_manager.get_all():
@@ -867,6 +1476,8 @@ class GlobalContainer(box.BoxLayout):
                 for r in rules:
                     stream.write(r)
                     stream.write('\n')
+        elif ext in model_export.writers:
+            self.export_models(os.path.join(path, filename))
         else:
             error_str = 'File extension not supported.'
             print error_str
@@ -874,6 +1485,33 @@ class GlobalContainer(box.BoxLayout):
             return
         self.dismiss_popup()
 
+    def export_models(self, filename):
+        """Writes every stable model of the active graph to filename in the
+        solver pool, shown with the last output predicates."""
+        # Consequences, projections and counts are not models
+        settings = dict(self.solver_settings, enum_mode='all')
+        show = []
+        if self.last_predicates:
+            try:
+                show = get_signatures(self.last_predicates)
+            except Exception:
+                pass
+
+        def on_finish(pending):
+            self.close_progress(progress)
+            if pending.error is not None:
+                self.show_error(pending.error)
+                return
+            text = '{0}{1} models written to\n{2}'.format(
+                pending.models_found,
+                '' if pending.is_exhausted() else '+', filename)
+            self.show_message('Export', text)
+        pending = self.submit_query(settings, show=show, query='export',
+                                    argument=filename, on_finish=on_finish)
+        if pending is not None:
+            progress = self.show_progress(pending, 'Export',
+                                          text='{0} models written')
+
     def highlight_variables(self):
         self.active_graph.highlight_variables()
 
@@ -881,42 +1519,127 @@ class GlobalContainer(box.BoxLayout):
         print self.active_graph.get_formula()
 
     def gringo_query(self, show_predicates):
-        def generate_show_statements(predicates):
-            pred_list = predicates.split(',')
-            pred_list = map(lambda s: s.strip(), pred_list)
-            n_args = (lambda name:
-                      self.name_manager.get(name).hook_points.count(True))
-            pred_list = [p + '/' + str(n_args(p)) for p in pred_list]
-            show_list = ['#show {0}.'.format(p) for p in pred_list]
-            return show_list
-
         self.dismiss_popup()
+        self.run_query(show_predicates)
 
-        rpn = self.active_graph.get_formula_RPN()
-        rpn = norm.LIT.TRUE if rpn == '' else rpn
+    def run_query(self, show_predicates):
+        self.last_predicates = show_predicates
+        self.active_graph.clear_highlight()
+        parts = self.active_graph.get_formula_parts()
         constants = self.active_graph.get_constants()
         print 80 * '-'
-        print 'RPN formula:\n', rpn
+        print 'RPN formula parts:'
+        for _, rpn in parts:
+            print rpn
 
-        solver = eg_solver.Solver()
-        result = ''
+        show_signatures = []
+        if show_predicates:
+            try:
+                show_signatures = get_signatures(show_predicates)
+            except Exception:
+                pass
+        if self.solver_settings['enum_mode'] == 'count':
+            self.count_models(show_signatures)
+            return
+
+        solver = self.get_solver()
         try:
-            show_statements = []
-            if show_predicates:
-                try:
-                    show_statements = generate_show_statements(show_predicates)
-                except Exception:
-                    pass
-            solver.set_formula(rpn, constants)
-            result = solver.solve(show=show_statements)
+            solver.set_parts(parts, constants)
+            solver.set_assumptions(self.assumptions)
         except norm.MalformedFormulaError:
             self.show_error('Malformed formula.')
             return
-        except RuntimeError, e:
-            print e
-            self.show_error(str(e))
-            return
-        self.show_stable_models(solver)
+
+        # Solving runs in a worker thread, results are posted back to the
+        # main loop through the Clock. The dialog opens on the first model.
+        self.query_generation += 1
+        generation = self.query_generation
+        opened = []
+        def on_model(solver):
+            if not opened:
+                opened.append(True)
+                self.post_query_callback(generation, self.show_stable_models,
+                                         solver)
+
+        def on_finish(solver, result, error):
+            self.post_query_callback(generation, self.gringo_query_finished,
+                                     solver, result, error)
+
+        solver.solve_async(show=show_signatures,
+                           on_model=on_model, on_finish=on_finish)
+
+    def count_models(self, show_signatures):
+        """Counts the stable models of the active graph in the solver pool,
+        showing how many it has found so far."""
+        self.query_generation += 1
+        generation = self.query_generation
+
+        def on_finish(pending):
+            self.post_query_callback(generation, self.count_finished,
+                                     pending)
+        pending = self.submit_query(self.solver_settings,
+                                    show=show_signatures,
+                                    on_finish=on_finish)
+        if pending is not None:
+            self.progress = self.show_progress(pending, 'Stable Models')
+
+    def count_finished(self, pending):
+        if self.progress is not None:
+            self.close_progress(self.progress)
+            self.progress = None
+        if pending.error is not None:
+            print pending.error
+            self.show_error(pending.error)
+        else:
+            self.show_model_count(pending)
+
+    def gringo_query_finished(self, solver, result, error):
+        if error is not None:
+            print error
+            if isinstance(error, norm.MalformedFormulaError):
+                self.show_error('Malformed formula.')
+            else:
+                self.show_error(str(error))
+        elif result == 'UNSAT':
+            self.find_unsat_core(solver)
+
+    def post_query_callback(self, generation, callback, *args):
+        """Calls callback on the main loop, unless a later query has started
+        meanwhile."""
+        def post(dt):
+            if generation == self.query_generation:
+                callback(*args)
+        clock.Clock.schedule_once(post)
+
+    def find_unsat_core(self, solver):
+        """Looks for the items of the active graph that have no stable model
+        together, in the background, and highlights them."""
+        graph = self.active_graph
+        generation = self.query_generation
+
+        def on_finish(solver, core, error):
+            if error is not None:
+                print 'Unsatisfiable core not available:', error
+                core = None
+            self.post_query_callback(generation, self.show_unsat_core,
+                                     graph, core)
+        solver.run_async(solver.get_unsat_core, on_finish)
+
+    def show_unsat_core(self, graph, core):
+        text = 'Unsatisfiable'
+        if core is not None:
+            graph.highlight_widgets(core)
+            items = [w for w in core if w is not graph]
+            if items:
+                text += ('\n{0} highlighted items have no model '
+                         'together.').format(len(items))
+            elif not core:
+                text += '\nThe what-if assumptions have no model.'
+        print text
+        content = ErrorDialog(text, cancel=self.dismiss_popup)
+        p = CustomPopup(self, title="Stable Models", content=content,
+                        size_hint=(0.9, 0.9))
+        self.push_popup(p)
 
     def begin_tutorial(self):
         if self.tutorial is not None:
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2017 Carlos Pérez Ramil <c.pramil at udc.es>
+
+# This file is part of ASP-Graph.
+
+# ASP-Graph is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# ASP-Graph is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with ASP-Graph.  If not, see <http://www.gnu.org/licenses/>.
+
+"""MODEL EXPORT MODULE
+
+Writers that stream stable models to a file one at a time, as the solver
+finds them. Supported formats:
+
+* JSON Lines (.jsonl): one object per model,
+  {"model": 1, "atoms": [{"predicate": "p", "args": ["a", 1]}, ...]}.
+  Numbers and strings are written as JSON numbers and strings, constants
+  as strings, tuples as lists, and other compound terms as objects with a
+  "name" and "args".
+* CSV (.csv): one row per atom, with the model number, the predicate and
+  its arguments, joined by commas in a single column. A model without atoms
+  has a single row with an empty predicate.
+"""
+
+import os
+import csv
+import json
+
+import clingo
+
+def term_to_json(term):
+    """Returns the JSON value of a clingo.Symbol used as a term."""
+    if term.type == clingo.SymbolType.Number:
+        return term.number
+    if term.type == clingo.SymbolType.String:
+        return term.string
+    if term.type == clingo.SymbolType.Infimum:
+        return '#inf'
+    if term.type == clingo.SymbolType.Supremum:
+        return '#sup'
+    args = [term_to_json(t) for t in term.arguments]
+    if term.name == '':
+        return args
+    if not args:
+        return term.name
+    return {'name': term.name, 'args': args}
+
+class JsonLinesWriter(object):
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, number, symbols):
+        atoms = [{'predicate': s.name,
+                  'args': [term_to_json(t) for t in s.arguments]}
+                 for s in symbols]
+        json.dump({'model': number, 'atoms': atoms}, self.stream,
+                  separators=(',', ':'))
+        self.stream.write('\n')
+
+class CsvWriter(object):
+
+    def __init__(self, stream):
+        self.writer = csv.writer(stream)
+        self.writer.writerow(['model', 'predicate', 'arguments'])
+
+    def write(self, number, symbols):
+        rows = [[number, s.name, ','.join(str(t) for t in s.arguments)]
+                for s in symbols]
+        self.writer.writerows(rows or [[number, '', '']])
+
+writers = {'.jsonl': JsonLinesWriter, '.csv': CsvWriter}
+
+def get_writer(path, stream):
+    """Returns the writer for the extension of path on stream.
+
+    Raises:
+    ValueError if the extension is not supported
+    """
+    _, ext = os.path.splitext(path)
+    try:
+        return writers[ext.lower()](stream)
+    except KeyError:
+        raise ValueError('Unsupported model file: {0}'.format(path))
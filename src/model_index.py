@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2017 Carlos Pérez Ramil <c.pramil at udc.es>
+
+# This file is part of ASP-Graph.
+
+# ASP-Graph is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# ASP-Graph is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with ASP-Graph.  If not, see <http://www.gnu.org/licenses/>.
+
+"""MODEL INDEX MODULE
+
+Index from every atom to the set of stored models that contain it, kept as
+a bitset over the model numbers. Queries combining atoms that must and must
+not hold are answered with bitwise operations over whole bitsets.
+
+Atom frequencies and co-occurrences are computed over a models x atoms
+boolean matrix (see count_atoms).
+
+The bitsets are NumPy packed arrays when NumPy is available, and Python
+integers otherwise.
+"""
+
+import unittest
+import collections
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from model_store import ModelStore, SymbolTable
+
+class ModelIndex(object):
+    """Atom to models index of a ModelStore.
+
+    Models stored after the index was built are added by update(), which
+    find() calls, so the index follows an enumeration in progress.
+    """
+
+    def __init__(self, store, use_numpy=True):
+        self.store = store
+        self.use_numpy = use_numpy and (np is not None)
+        # Models already in the bitsets
+        self._count = 0
+        # {atom_id: bitset}
+        self._bits = {}
+
+    def __len__(self):
+        return self._count
+
+    def update(self):
+        """Adds the models stored since the last update."""
+        count = len(self.store)
+        if count == self._count:
+            return
+        if count < self._count:
+            # The store was cleared
+            self._count = 0
+            self._bits = {}
+        new = collections.defaultdict(list)
+        for i in xrange(self._count, count):
+            for atom_id in self.store[i]:
+                new[atom_id].append(i)
+        if self.use_numpy:
+            for atom_id, models in new.iteritems():
+                flags = np.zeros(count, dtype=bool)
+                old = self._bits.get(atom_id)
+                if old is not None:
+                    old = np.unpackbits(old)[:self._count]
+                    flags[:len(old)] = old
+                flags[models] = True
+                self._bits[atom_id] = np.packbits(flags)
+        else:
+            for atom_id, models in new.iteritems():
+                bits = self._bits.get(atom_id, 0)
+                for i in models:
+                    bits |= 1 << i
+                self._bits[atom_id] = bits
+        self._count = count
+
+    def _get_bits(self, atom_id):
+        bits = self._bits.get(atom_id)
+        if not self.use_numpy:
+            return bits or 0
+        # Bitsets of atoms missing from the last models are shorter
+        size = (self._count + 7) // 8
+        if bits is None:
+            return np.zeros(size, dtype=np.uint8)
+        if len(bits) < size:
+            bits = np.concatenate([bits, np.zeros(size - len(bits),
+                                                  dtype=np.uint8)])
+        return bits
+
+    def find(self, positive=[], negative=[]):
+        """Returns the numbers of the models that contain every atom id in
+        positive and none of the atom ids in negative, in order."""
+        self.update()
+        count = self._count
+        if self.use_numpy:
+            result = np.packbits(np.ones(count, dtype=bool))
+            for atom_id in positive:
+                result &= self._get_bits(atom_id)
+            for atom_id in negative:
+                result &= ~self._get_bits(atom_id)
+            return np.flatnonzero(np.unpackbits(result)[:count]).tolist()
+        result = (1 << count) - 1
+        for atom_id in positive:
+            result &= self._get_bits(atom_id)
+        for atom_id in negative:
+            result &= ~self._get_bits(atom_id)
+        return [i for i in xrange(count) if (result >> i) & 1]
+
+    def count(self, atom_id):
+        """Returns the number of models that contain atom_id."""
+        self.update()
+        bits = self._get_bits(atom_id)
+        if self.use_numpy:
+            return int(np.unpackbits(bits).sum())
+        return bin(bits).count('1')
+
+
+def count_atoms(store, atom_ids, pairs=True, use_numpy=True):
+    """Counts the models of a ModelStore containing each atom of atom_ids,
+    and each pair of them.
+
+    Returns:
+    A list with the number of models containing atom_ids[j] at position j,
+    and a matrix (list of lists or NumPy array) with the number of models
+    containing both atom_ids[j] and atom_ids[k] at [j][k], or None if
+    pairs is False
+    """
+    if use_numpy and (np is not None):
+        return _count_atoms_numpy(store, atom_ids, pairs)
+    column = dict((atom_id, j) for j, atom_id in enumerate(atom_ids))
+    counts = [0] * len(atom_ids)
+    both = [[0] * len(atom_ids) for _ in atom_ids] if pairs else None
+    for model in store:
+        present = [column[a] for a in model if a in column]
+        for j in present:
+            counts[j] += 1
+            if pairs:
+                row = both[j]
+                for k in present:
+                    row[k] += 1
+    return counts, both
+
+def model_atoms(store, use_numpy=True):
+    """Returns the sorted ids of the atoms in some model of a ModelStore."""
+    if use_numpy and (np is not None):
+        if not len(store):
+            return []
+        return np.unique(_concatenate(store)).tolist()
+    return sorted(set(i for m in store for i in m))
+
+def _concatenate(store):
+    """Returns the atom id arrays of all the models as one NumPy array."""
+    dtype = np.dtype('u{0}'.format(store[0].itemsize))
+    return np.concatenate([np.frombuffer(m, dtype=dtype) for m in store])
+
+def _count_atoms_numpy(store, atom_ids, pairs):
+    # The models x atoms matrix is filled at once from the concatenated
+    # atom id arrays of all the models
+    matrix = np.zeros((len(store), len(atom_ids)), dtype=bool)
+    if len(store) and len(atom_ids):
+        flat = _concatenate(store)
+        rows = np.repeat(np.arange(len(store)), [len(m) for m in store])
+        column = np.full(max(len(store.table), max(atom_ids) + 1), -1,
+                         dtype=np.int64)
+        column[list(atom_ids)] = np.arange(len(atom_ids))
+        columns = column[flat]
+        selected = columns >= 0
+        matrix[rows[selected], columns[selected]] = True
+    counts = matrix.sum(axis=0).tolist()
+    both = None
+    if pairs:
+        m = matrix.astype(np.int32)
+        both = m.T.dot(m)
+    return counts, both
+
+
+class ModelIndexTest(unittest.TestCase):
+
+    # Stand-in for clingo.Symbol
+    Symbol = collections.namedtuple('Symbol', 'name arguments')
+
+    def setUp(self):
+        self.store = ModelStore(SymbolTable._decorated())
+        p, q, r = [self.Symbol(n, ()) for n in 'pqr']
+        for model in ([p], [p, q], [q], [p, q, r]):
+            self.store.append(model)
+        self.p, self.q, self.r = [self.store.table.lookup(s)
+                                  for s in (p, q, r)]
+
+    def check(self, index):
+        self.assertEqual(index.find([self.p]), [0, 1, 3])
+        self.assertEqual(index.find([self.p], [self.q]), [0])
+        self.assertEqual(index.find([], [self.p, self.r]), [2])
+        self.assertEqual(index.count(self.q), 3)
+        self.store.append([self.Symbol('r', ())])
+        self.assertEqual(index.find([self.r], [self.q]), [4])
+        self.assertEqual(index.find([self.p]), [0, 1, 3])
+
+    def test_integers(self):
+        self.check(ModelIndex(self.store, use_numpy=False))
+
+    @unittest.skipIf(np is None, 'NumPy is not available')
+    def test_numpy(self):
+        self.check(ModelIndex(self.store))
+
+    def check_counts(self, use_numpy):
+        atoms = [self.q, self.p]
+        counts, both = count_atoms(self.store, atoms, use_numpy=use_numpy)
+        self.assertEqual(list(counts), [3, 3])
+        self.assertEqual([list(row) for row in both], [[3, 2], [2, 3]])
+
+    def test_counts(self):
+        self.check_counts(False)
+
+    @unittest.skipIf(np is None, 'NumPy is not available')
+    def test_counts_numpy(self):
+        self.check_counts(True)
+
+    def test_model_atoms(self):
+        atoms = sorted([self.p, self.q, self.r])
+        self.assertEqual(model_atoms(self.store, use_numpy=False), atoms)
+        self.assertEqual(model_atoms(ModelStore(SymbolTable._decorated()),
+                                     use_numpy=False), [])
+
+    @unittest.skipIf(np is None, 'NumPy is not available')
+    def test_model_atoms_numpy(self):
+        atoms = sorted([self.p, self.q, self.r])
+        self.assertEqual(model_atoms(self.store), atoms)
+        self.assertEqual(model_atoms(ModelStore(SymbolTable._decorated())),
+                         [])
+
+
+if __name__ == '__main__':
+    unittest.main()
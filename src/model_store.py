@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2017 Carlos Pérez Ramil <c.pramil at udc.es>
+
+# This file is part of ASP-Graph.
+
+# ASP-Graph is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# ASP-Graph is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with ASP-Graph.  If not, see <http://www.gnu.org/licenses/>.
+
+"""MODEL STORE MODULE
+
+Compact storage for stable models. Every atom is interned once in a shared
+symbol table, and a model is kept as a sorted array of integer atom ids.
+"""
+
+import array
+import threading
+import unittest
+import collections
+
+from name_manager import Singleton
+
+@Singleton
+class SymbolTable:
+    """Interned table of atoms (clingo.Symbol objects) shared by all solvers.
+
+    Ids are assigned in order of appearance and never change, so a model
+    stored as a list of ids stays valid for the whole session. The signature
+    (name, arity) of every atom is indexed as well, for output projection.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._symbols = []
+        self._signatures = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._symbols)
+
+    def intern(self, symbol):
+        try:
+            return self._ids[symbol]
+        except KeyError:
+            with self._lock:
+                if symbol not in self._ids:
+                    self._signatures.append(self.get_signature(symbol))
+                    self._ids[symbol] = len(self._symbols)
+                    self._symbols.append(symbol)
+                return self._ids[symbol]
+
+    @staticmethod
+    def get_signature(symbol):
+        return (symbol.name, len(symbol.arguments))
+
+    def lookup(self, symbol):
+        """Returns the id of symbol, or None if it was never interned."""
+        return self._ids.get(symbol)
+
+    def get(self, atom_id):
+        return self._symbols[atom_id]
+
+    def signature(self, atom_id):
+        return self._signatures[atom_id]
+
+
+class ModelStore(object):
+    """Read-only sequence of stable models.
+
+    Each model is an array of sorted atom ids referring to the SymbolTable.
+    Indexing returns the stored array itself, no copies are made.
+    """
+
+    typecode = 'I'
+
+    def __init__(self, table=None):
+        self.table = table if table is not None else SymbolTable.Instance()
+        self._models = []
+
+    def __len__(self):
+        return len(self._models)
+
+    def __getitem__(self, index):
+        return self._models[index]
+
+    def __iter__(self):
+        return iter(self._models)
+
+    def append(self, symbols):
+        ids = sorted(self.table.intern(s) for s in symbols)
+        self._models.append(array.array(self.typecode, ids))
+
+    def clear(self):
+        self._models = []
+
+    def symbols(self, model):
+        """Returns the atoms of a stored model (or of its index)."""
+        if isinstance(model, int):
+            model = self._models[model]
+        return [self.table.get(i) for i in model]
+
+    def project(self, model, signatures):
+        """Returns the ids of a stored model (or of its index) whose atom
+        matches one of the (name, arity) signatures. An empty collection of
+        signatures keeps every atom."""
+        if isinstance(model, int):
+            model = self._models[model]
+        if not signatures:
+            return model
+        signature = self.table.signature
+        return [i for i in model if signature(i) in signatures]
+
+
+class ModelStoreTest(unittest.TestCase):
+
+    # Stand-in for clingo.Symbol
+    Symbol = collections.namedtuple('Symbol', 'name arguments')
+
+    def setUp(self):
+        self.table = SymbolTable._decorated()
+        self.store = ModelStore(self.table)
+        self.p = self.Symbol('p', ())
+        self.qa = self.Symbol('q', ('a',))
+        self.qab = self.Symbol('q', ('a', 'b'))
+
+    def test_interning(self):
+        self.assertEqual(self.table.intern(self.p), 0)
+        self.assertEqual(self.table.intern(self.qa), 1)
+        self.assertEqual(self.table.intern(self.p), 0)
+        self.assertEqual(self.table.lookup(self.qa), 1)
+        self.assertEqual(self.table.lookup(self.qab), None)
+        self.assertEqual(len(self.table), 2)
+
+    def test_store(self):
+        self.store.append([self.qa, self.p])
+        self.store.append([self.p])
+        self.assertEqual(len(self.store), 2)
+        self.assertEqual(list(self.store[0]), [0, 1])
+        self.assertEqual(self.store.symbols(0), [self.qa, self.p])
+        self.assertEqual(self.store.symbols(self.store[1]), [self.p])
+
+    def test_project(self):
+        self.store.append([self.qab, self.qa, self.p])
+        self.assertEqual(self.table.signature(0), ('q', 2))
+        self.assertEqual(self.table.signature(2), ('p', 0))
+        self.assertEqual(self.store.project(0, set([('q', 1), ('p', 0)])),
+                         [1, 2])
+        self.assertEqual(list(self.store.project(0, set())), [0, 1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2017 Carlos Pérez Ramil <c.pramil at udc.es>
+
+# This file is part of ASP-Graph.
+
+# ASP-Graph is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# ASP-Graph is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with ASP-Graph.  If not, see <http://www.gnu.org/licenses/>.
+
+"""SOLVE CACHE MODULE
+
+LRU cache of complete solve results. Entries are keyed by a hash of the
+program rules and the solver arguments, and hold the ModelStore with every
+stable model of that program. Output predicates are applied when reading
+the models, so they are not part of the key.
+"""
+
+import os
+import errno
+import hashlib
+import threading
+import collections
+import cPickle as pickle
+
+import clingo
+
+from model_store import ModelStore
+
+class SolveCache(object):
+    """In-memory LRU cache of ModelStore objects.
+
+    When spill_dir is given, entries evicted from memory are written there
+    and loaded back on the next lookup, which removes the file. At most
+    spill_capacity files are kept, the oldest ones are removed first.
+    """
+
+    def __init__(self, capacity=16, spill_dir=None, spill_capacity=64):
+        self.capacity = capacity
+        self.spill_dir = spill_dir
+        self.spill_capacity = spill_capacity
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(rules, arguments=[]):
+        h = hashlib.sha1()
+        for part in (sorted(rules), list(arguments)):
+            for s in part:
+                h.update(s)
+                h.update('\n')
+            h.update('\0')
+        return h.hexdigest()
+
+    def get(self, key):
+        """Returns the ModelStore cached under key, or None."""
+        with self._lock:
+            try:
+                models = self._entries.pop(key)
+            except KeyError:
+                models = self._load(key)
+                if models is None:
+                    return None
+            self._entries[key] = models
+            self._evict()
+            return models
+
+    def put(self, key, models):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = models
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _evict(self):
+        while len(self._entries) > self.capacity:
+            key, models = self._entries.popitem(last=False)
+            self._spill(key, models)
+
+    def _get_path(self, key):
+        return os.path.join(self.spill_dir, key + '.models')
+
+    def _spill(self, key, models):
+        if self.spill_dir is None:
+            return
+        try:
+            os.makedirs(self.spill_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        # Symbols are stored as strings, together with the models written
+        # against a local numbering of the atoms they use.
+        used = sorted(set(i for m in models for i in m))
+        local = dict((atom_id, n) for n, atom_id in enumerate(used))
+        data = {'symbols': [str(models.table.get(i)) for i in used],
+                'models': [[local[i] for i in m] for m in models]}
+        with open(self._get_path(key), 'wb') as stream:
+            pickle.dump(data, stream, pickle.HIGHEST_PROTOCOL)
+        self._trim_spill()
+
+    def _trim_spill(self):
+        paths = [os.path.join(self.spill_dir, name)
+                 for name in os.listdir(self.spill_dir)
+                 if name.endswith('.models')]
+        if len(paths) <= self.spill_capacity:
+            return
+        paths.sort(key=os.path.getmtime)
+        for path in paths[:len(paths) - self.spill_capacity]:
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _load(self, key):
+        if self.spill_dir is None:
+            return None
+        path = self._get_path(key)
+        try:
+            stream = open(path, 'rb')
+        except IOError:
+            return None
+        # The entry goes back to memory, and a damaged file is a miss
+        try:
+            with stream:
+                data = pickle.load(stream)
+            symbols = [clingo.parse_term(s) for s in data['symbols']]
+            models = ModelStore()
+            for m in data['models']:
+                models.append([symbols[i] for i in m])
+        except Exception as e:
+            print 'Could not load', path, e
+            return None
+        finally:
+            self._remove(path)
+        return models
@@ -17,11 +17,247 @@
 # You should have received a copy of the GNU General Public License
 # along with ASP-Graph.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import re
+import time
+import threading
+import hashlib
+import unittest
+import contextlib
+import collections
+
 import pygraphviz as pgv
 import clingo
 
 import normalization as norm
 from name_manager import NameManager
+from model_store import ModelStore
+from model_index import ModelIndex, count_atoms, model_atoms
+import model_export
+
+# Name of the external atoms guarding the program parts
+GUARD = '_part'
+
+def split_atoms(text):
+    """Splits a list of atoms, separated by spaces or commas, as printed
+    for a model."""
+    atoms = []
+    depth = 0
+    quoted = False
+    current = []
+    for i, c in enumerate(text):
+        if quoted:
+            quoted = not (c == '"' and text[i - 1] != '\\')
+        elif c == '"':
+            quoted = True
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif (depth == 0) and (c.isspace() or c == ','):
+            atoms.append(''.join(current))
+            current = []
+            continue
+        current.append(c)
+    atoms.append(''.join(current))
+    return [a for a in atoms if a]
+
+def add_guard(rule, guard):
+    """Adds the atom guard to the body of a rule produced by to_asp."""
+    rule = rule[:-1]
+    if ':-' in rule:
+        return '{0}, {1}.'.format(rule, guard)
+    return '{0} :- {1}.'.format(rule, guard)
+
+def get_predicates(text):
+    """Returns the names outside any argument list in the head or the body
+    of a rule produced by to_asp, which include all its predicates."""
+    names = set()
+    depth = 0
+    for token in re.findall(r'"(?:\\.|[^"\\])*"|[()]|[#\w]+', text):
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif (depth == 0) and token[0].islower() and (token != 'not'):
+            names.add(token)
+    return names
+
+@contextlib.contextmanager
+def stage_timer(times, stage):
+    """Adds the wall time spent in the with block to times[stage]."""
+    start = time.time()
+    try:
+        yield
+    finally:
+        times[stage] = times.get(stage, 0.0) + time.time() - start
+
+class GroundingObserver(object):
+    """Ground program observer that attributes every ground rule, and the
+    atoms in its head, to the program part it comes from. The part is found
+    through the guard atom _part(part_id) in the body of the rule."""
+
+    def __init__(self):
+        # Program atoms of the guards, {atom: part_id}
+        self.guards = {}
+        self.rules = collections.Counter()
+        self.atoms = collections.defaultdict(set)
+        self._pending = []
+
+    def output_atom(self, symbol, atom):
+        if symbol.name == GUARD:
+            self.guards[atom] = symbol.arguments[0].number
+
+    def rule(self, choice, head, body):
+        self._pending.append((head, body))
+
+    def weight_rule(self, choice, head, lower_bound, body):
+        self._pending.append((head, [l for l, w in body]))
+
+    def end_step(self):
+        # Atoms are only reported at the end of the step
+        for head, body in self._pending:
+            part_id = None
+            for l in body:
+                if l in self.guards:
+                    part_id = self.guards[l]
+                    break
+            self.rules[part_id] += 1
+            self.atoms[part_id].update(head)
+        self._pending = []
+
+class AspifWriter(object):
+    """Ground program observer that writes the first ground step of a
+    clingo.Control to a file in clingo's intermediate format (aspif).
+
+    The guards of the program parts are written as true externals, so the
+    file can be loaded on its own. The other externals, the atoms of the
+    assumptions, are written as free, since their values are assigned for
+    each query.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.closed = False
+        self._statements = []
+        self._externals = []
+        self._guards = set()
+
+    def _add(self, *numbers):
+        self._statements.append(' '.join(map(str, numbers)))
+
+    def rule(self, choice, head, body):
+        if not self.closed:
+            self._add(1, int(choice), len(head),
+                      *(list(head) + [0, len(body)] + list(body)))
+
+    def weight_rule(self, choice, head, lower_bound, body):
+        if not self.closed:
+            weighted = [x for l, w in body for x in (l, w)]
+            self._add(1, int(choice), len(head),
+                      *(list(head) + [1, lower_bound, len(body)] + weighted))
+
+    def project(self, atoms):
+        if not self.closed:
+            self._add(3, len(atoms), *atoms)
+
+    def output_atom(self, symbol, atom):
+        if self.closed:
+            return
+        if symbol.name == GUARD:
+            self._guards.add(atom)
+        name = str(symbol)
+        condition = [1, atom] if atom else [0]
+        self._add(4, len(name), name, *condition)
+
+    def external(self, atom, value):
+        if not self.closed:
+            self._externals.append(atom)
+
+    def end_step(self):
+        if self.closed:
+            return
+        self.closed = True
+        # Values: 0 free, 1 true
+        for atom in self._externals:
+            self._add(5, atom, 1 if atom in self._guards else 0)
+        statements, self._statements = self._statements, []
+        # It runs inside clingo, an error would abort the query
+        try:
+            with open(self.path, 'w') as stream:
+                stream.write('asp 1 0 0\n')
+                for s in statements:
+                    stream.write(s + '\n')
+                stream.write('0\n')
+        except (IOError, OSError) as e:
+            print 'Could not write', self.path, e
+            # A partial file would be loaded by the next query
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            return
+        print 'Ground program written to', self.path
+
+class SolveResult(object):
+    """Outcome of a query: its status ('SAT', 'UNSAT', or 'UNKNOWN' if it
+    was stopped before the first model), the wall time of every stage, rule
+    and model counts, and the clingo statistics.
+
+    It compares equal to its status string, so it can be used where a
+    'SAT'/'UNSAT' string was expected.
+    """
+
+    stages = ('constants', 'pnf', 'normalization', 'to_asp', 'add', 'ground',
+              'solve')
+
+    def __init__(self):
+        self.status = 'Undefined'
+        self.times = dict((stage, 0.0) for stage in self.stages)
+        self.rules = 0
+        self.new_rules = 0
+        self.models = 0
+        self.cached = False
+        self.statistics = {}
+
+    def __str__(self):
+        return self.status
+
+    def __eq__(self, other):
+        if isinstance(other, basestring):
+            return self.status == other
+        return self is other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def get_summary(self):
+        """Returns the main clingo statistics: choices, conflicts, and the
+        atoms and rules of the ground program."""
+        summary = {}
+        solvers = self.statistics.get('solving', {}).get('solvers', {})
+        lp = self.statistics.get('problem', {}).get('lp', {})
+        for name, stats in (('choices', solvers), ('conflicts', solvers),
+                            ('atoms', lp), ('rules', lp)):
+            if name in stats:
+                summary[name] = int(stats[name])
+        return summary
+
+    def format(self):
+        """Returns a printable report of the result."""
+        lines = ['Result: {0}{1}'.format(self.status,
+                                         ' (cached)' if self.cached else ''),
+                 'Models: {0}'.format(self.models),
+                 'Rules: {0} ({1} grounded)'.format(self.rules,
+                                                    self.new_rules)]
+        lines.extend('Time {0}: {1:.4f} s'.format(stage, self.times[stage])
+                     for stage in self.stages)
+        summary = self.get_summary()
+        lines.extend('Ground {0}: {1}'.format(name, summary[name])
+                     for name in ('atoms', 'rules') if name in summary)
+        lines.extend('{0}: {1}'.format(name.capitalize(), summary[name])
+                     for name in ('choices', 'conflicts') if name in summary)
+        return '\n'.join(lines)
 
 class Solver(object):
     """Wrapper class for POTASSCO.
@@ -34,95 +270,980 @@ class Solver(object):
       Using the clingo module.
     * Generating an Equilibrium Graph from the set of Stable Models.
       Using the pygraphviz module.
+
+    Queries can also run in a background thread (see solve_async), so that
+    the caller keeps responding while models are being enumerated. In that
+    case the solve handle is kept open and models are pulled on demand,
+    staying only `lookahead` models ahead of the last one requested.
+
+    A Solver keeps its clingo.Control between queries. The formula is split
+    into parts (see set_parts), each one grounded in its own program part
+    and guarded by an external atom, so solving again after an edit only
+    grounds the parts that changed. Models are stored with all their atoms,
+    and the output predicates (see set_show) are only applied when reading
+    them, so changing them does not touch the grounded program.
+
+    Propositional atoms can also be fixed to true or false (see
+    set_assumption). They are passed as solve assumptions. Atoms that no
+    part defines are also declared #external in a small program part of
+    their own, grounded together with the parts, so that they can be true.
+    Only a new assumption on such an atom, when the grounded parts already
+    use it, grounds them again.
+
+    With enum_mode 'brave' or 'cautious' clingo computes the atoms true in
+    some or in every stable model instead. Each model it reports is a
+    better approximation of the consequences, so only the last one is kept.
+    Mode 'project' enumerates the distinct projections of the models on the
+    output predicates, and mode 'count' only counts the models.
     """
 
-    program_id = 0
+    lookahead = 5
 
-    def __init__(self, **kwargs):
-        self.solver = clingo.Control()
-        self.formula = None
+    # Clasp search strategies for multi-threaded solving, and the
+    # configuration presets (portfolios) used to set up the solver threads.
+    parallel_modes = ('compete', 'split')
+    configurations = ('auto', 'frumpy', 'jumpy', 'tweety', 'trendy', 'crafty')
+    # Enumeration modes: every model, consequences, projections or count
+    enum_modes = ('all', 'brave', 'cautious', 'project', 'count')
+
+    # Graphviz layout programs for model graphs, 'auto' chooses one by the
+    # size (nodes and edges) of the graph. Graphs larger than huge_graph are
+    # listed as a table instead.
+    layout_engines = ('auto', 'dot', 'neato', 'sfdp', 'table')
+    large_graph = 200
+    huge_graph = 5000
+
+    def __init__(self, threads=1, parallel_mode='compete',
+                 configuration='auto', enum_mode='all', cache=None, **kwargs):
+        if threads < 1:
+            raise ValueError('Invalid number of threads: {0}'.format(threads))
+        if parallel_mode not in self.parallel_modes:
+            raise ValueError('Invalid parallel mode: {0}'.format(parallel_mode))
+        if configuration not in self.configurations:
+            raise ValueError('Invalid configuration: {0}'.format(configuration))
+        if enum_mode not in self.enum_modes:
+            raise ValueError('Invalid enumeration mode: {0}'.format(enum_mode))
+        self.threads = threads
+        self.parallel_mode = parallel_mode
+        self.configuration = configuration
+        self.enum_mode = enum_mode
+        # Optional SolveCache shared by several solvers
+        self.cache = cache
+        self.solver = None
+        self.parts = []
         self.constants = {}
-        self.stable_models = []
+        self.show = set()
+        self.assumptions = {}
+        self.stable_models = ModelStore()
+        # Models reported by clingo in the last query, and the time taken
+        self.models_found = 0
+        self.solve_time = None
+        # SolveResult of the last query
+        self.result = SolveResult()
+        # Writer of model_export that models are streamed to, instead of
+        # being stored
+        self._model_writer = None
+        self._model_index = None
+        self._thread = None
+        self._handle = None
+        self._stop_event = threading.Event()
+        # Number of models the enumeration may reach before pausing.
+        # None means no limit.
+        self._demand = None
+        self._demand_cond = threading.Condition()
+        self._exhausted = False
+        # Normalized rules of the last parts, by RPN formula and constants
+        self._rules = {}
+        # Grounded parts: {frozenset(rules): part_id}, and their tags
+        self._active = {}
+        self._part_tags = {}
+        self._next_part = 0
+        # Predicates used by the parts grounded in the clingo.Control
+        self._predicates = set()
+        # Atom names declared #external for assumptions, and the names in
+        # the heads of the current parts, which are never declared
+        self._externals = set()
+        self._heads = set()
+        # Signatures of the #project directives in the grounded program
+        self._projection = None
+        # GroundingObserver to register on the next clingo.Control
+        self._observer = None
+        # Document of the parts, its ground programs are stored next to it
+        self.document = None
+        self._parts_key = None
+        # Ground program file loaded in the current clingo.Control
+        self._ground_file = None
+        # Graphviz is not thread safe, graphs are drawn one at a time
+        self._graph_lock = threading.Lock()
+        # With a stable layout, node positions are computed for the union of
+        # the nodes of all the models drawn, and kept for the next ones
+        self.stable_layout = False
+        self.layout_engine = 'auto'
+        self._union_nodes = {}
+        self._union_edges = set()
+        self._positions = {}
+        self._union_engine = None
+        # Changes whenever the stable layout moves its nodes
+        self.layout_generation = 0
 
     def _reset_solver(self):
-        self.solver = clingo.Control()
+        self.solver = clingo.Control(self.get_arguments())
         self.solver.configuration.solve.models = 0
-        self.program_id += 1
+        if self._observer is not None:
+            self.solver.register_observer(self._observer)
+        self._active = {}
+        self._part_tags = {}
+        self._predicates = set()
+        self._externals = set()
+        self._heads = set()
+        self._ground_file = None
+
+    def get_arguments(self):
+        """Returns the clingo command line arguments of this configuration."""
+        arguments = ['--configuration={0}'.format(self.configuration),
+                     '--parallel-mode={0},{1}'.format(self.threads,
+                                                      self.parallel_mode)]
+        if self.is_consequences():
+            arguments.append('--enum-mode={0}'.format(self.enum_mode))
+        elif self.enum_mode == 'project':
+            arguments.append('--project')
+        return arguments
+
+    def get_settings(self):
+        """Returns the keyword arguments that configure this solver."""
+        return {'threads': self.threads,
+                'parallel_mode': self.parallel_mode,
+                'configuration': self.configuration,
+                'enum_mode': self.enum_mode}
+
+    def is_consequences(self):
+        """True when computing brave or cautious consequences."""
+        return self.enum_mode in ('brave', 'cautious')
+
+    def is_count_only(self):
+        """True when models are counted but not stored."""
+        return self.enum_mode == 'count'
+
+    def get_throughput(self):
+        """Returns the models found per second in the last query, or None
+        if it is not finished."""
+        if not self.solve_time:
+            return None
+        return self.models_found / self.solve_time
 
     def get_models(self):
-        return tuple(self.stable_models)
+        return self.stable_models
 
-    def set_formula(self, rpn_formula, constants={}):
-        self.formula = norm.Formula(rpn_formula)
+    def get_model_count(self):
+        return len(self.stable_models)
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def is_exhausted(self):
+        """True when every stable model has been enumerated."""
+        return self._exhausted
+
+    def request_model(self, index):
+        """Let a paused enumeration go on until the model at position index
+        and the following look-ahead models are available."""
+        with self._demand_cond:
+            if self._demand is not None:
+                self._demand = max(self._demand, index + 1 + self.lookahead)
+            self._demand_cond.notify()
+
+    def set_parts(self, parts, constants={}):
+        """Sets the formula to solve as a conjunction of independent parts.
+
+        Arguments:
+        parts: List of (tag, rpn_formula) pairs. The tag identifies the
+        diagram element the part comes from.
+        constants: Dict of constant names and the variables they replace
+        """
+        self._join()
+        self.parts = [(tag, norm.Formula(rpn)) for tag, rpn in parts]
         self.constants = constants
-        self.stable_models = []
+        self.stable_models = ModelStore()
+        h = hashlib.sha1()
+        for s in sorted(rpn for _, rpn in parts):
+            h.update(s + '\n')
+        h.update(repr(sorted(constants.items())))
+        self._parts_key = h.hexdigest()
+
+    def set_document(self, path):
+        """Sets the file the parts come from, or None. Ground programs are
+        then stored next to it (see get_ground_path)."""
+        self.document = path
+
+    def get_ground_path(self):
+        """Returns the aspif file for the ground program of the current
+        parts, or None if it is not stored.
+
+        The file is keyed by the formulas and constants of the parts, so it
+        can be found without normalizing them, and by the atoms with an
+        assumption, some of which are declared external in it.
+        """
+        if (self.document is None) or (self.enum_mode == 'project'):
+            return None
+        h = hashlib.sha1(self._parts_key)
+        h.update(repr(sorted(self.assumptions)))
+        base, _ = os.path.splitext(self.document)
+        return '{0}.{1}.aspif'.format(base, h.hexdigest()[:16])
+
+    def _remove_ground_programs(self, keep):
+        """Removes the ground programs stored for other versions of the
+        document than the file keep."""
+        base, _ = os.path.splitext(self.document)
+        directory = os.path.dirname(base)
+        pattern = re.compile(re.escape(os.path.basename(base)) +
+                             r'\.[0-9a-f]{16}\.aspif$')
+        try:
+            names = os.listdir(directory or os.curdir)
+        except OSError as e:
+            print 'Could not list', directory, e
+            return
+        for name in names:
+            path = os.path.join(directory, name)
+            if pattern.match(name) and (path != keep):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    print 'Could not remove', path, e
+
+    def _load_ground_program(self, path):
+        """Loads a stored ground program in a new clingo.Control, unless it
+        is already loaded.
+
+        Returns:
+        True if the program is loaded
+        """
+        if self._ground_file == path:
+            return True
+        if not os.path.exists(path):
+            return False
+        self._reset_solver()
+        try:
+            with stage_timer(self.result.times, 'ground'):
+                self.solver.load(path)
+                self.solver.ground([('base', [])])
+        except RuntimeError as e:
+            print 'Could not load', path, e
+            self.solver = None
+            return False
+        print 'Ground program loaded from', path
+        self._ground_file = path
+        self._projection = None
+        self._externals = set(a.symbol.name
+                              for a in self.solver.symbolic_atoms
+                              if a.is_external and a.symbol.name != GUARD)
+        return True
+
+    def set_formula(self, rpn_formula, constants={}):
+        self.set_parts([(None, rpn_formula)], constants)
+
+    def set_show(self, signatures):
+        """Sets the output predicates, as (name, arity) pairs. Every atom is
+        shown when there are none."""
+        self.show = set(signatures)
+
+    def set_assumption(self, name, value):
+        """Fixes the propositional atom name to value (True or False) in the
+        next queries. A value of None leaves the atom free again."""
+        if value is None:
+            self.assumptions.pop(name, None)
+        else:
+            self.assumptions[name] = value
+
+    def set_assumptions(self, assumptions):
+        self.assumptions = dict(assumptions)
+
+    def get_shown_symbols(self, model):
+        """Returns the shown atoms of a stored model (or of its index)."""
+        models = self.stable_models
+        return models.symbols(models.project(model, self.show))
+
+    def get_model_index(self):
+        """Returns the atom to models index of the stored models."""
+        if (self._model_index is None or
+            self._model_index.store is not self.stable_models):
+            self._model_index = ModelIndex(self.stable_models)
+        return self._model_index
+
+    def find_models(self, query):
+        """Returns the numbers of the stored models matching query.
+
+        Arguments:
+        query: Ground atoms that must hold, joined by 'and', each one
+        preceded by 'not' if it must not hold instead. For example:
+        'colored(n3,red) and not colored(n4,red)'
+        Raises:
+        RuntimeError if an atom cannot be parsed
+        """
+        table = self.stable_models.table
+        positive, negative = [], []
+        for literal in re.split(r'\s+and\s+', query.strip()):
+            negated = re.match(r'not\s+', literal)
+            if negated:
+                literal = literal[negated.end():]
+            atom_id = table.lookup(clingo.parse_term(literal))
+            if atom_id is not None:
+                (negative if negated else positive).append(atom_id)
+            elif not negated:
+                # An atom in no model at all
+                return []
+        return self.get_model_index().find(positive, negative)
+
+    def get_atom_statistics(self):
+        """Computes how often every atom holds in the stored models.
+
+        The atoms are those of the models and those of the grounded program
+        with a predicate the current parts use, of the output predicates
+        only if there are any. Pairs of atoms are only
+        compared when output predicates are set, since they grow
+        quadratically.
+
+        Returns:
+        A dict with the number of 'models', the atoms true in every model
+        ('always') and in none ('never'), the (atom, count) 'frequencies'
+        of the rest, most frequent first, and the pairs of them that are
+        always true 'together'
+        """
+        models = self.stable_models
+        table = models.table
+        # Every atom of a model is an atom of the program that produced it,
+        # unless the models came from the cache
+        ids = set(model_atoms(models))
+        if (self.solver is not None) and not self.result.cached:
+            # The program also keeps the atoms of released parts and of
+            # externals without an assumption, which no current part uses
+            if self._ground_file is None:
+                used = set(self.assumptions)
+                for rules in self._rules.itervalues():
+                    for r in rules:
+                        used.update(get_predicates(r))
+                keep = lambda name: name in used
+            else:
+                # A loaded program has no released parts
+                stale = self._externals.difference(self.assumptions)
+                keep = lambda name: name not in stale
+            ids.update(table.intern(a.symbol)
+                       for a in self.solver.symbolic_atoms
+                       if keep(a.symbol.name))
+        ids = sorted(i for i in ids if table.signature(i)[0] != GUARD and
+                     (not self.show or table.signature(i) in self.show))
+        counts, both = count_atoms(models, ids, pairs=bool(self.show))
+        n = len(models)
+        stats = {'models': n,
+                 'always': [table.get(i) for i, c in zip(ids, counts)
+                            if c == n],
+                 'never': [table.get(i) for i, c in zip(ids, counts)
+                           if c == 0],
+                 'frequencies': [],
+                 'together': []}
+        sometimes = [j for j, c in enumerate(counts) if 0 < c < n]
+        sometimes.sort(key=lambda j: counts[j], reverse=True)
+        stats['frequencies'] = [(table.get(ids[j]), counts[j])
+                                for j in sometimes]
+        if both is not None:
+            for x, j in enumerate(sometimes):
+                for k in sometimes[x + 1:]:
+                    if both[j][k] == counts[j] == counts[k]:
+                        stats['together'].append((table.get(ids[j]),
+                                                  table.get(ids[k])))
+        return stats
+
+    @staticmethod
+    def get_guard(part_id):
+        return clingo.Function(GUARD, [part_id])
+
+    def _get_part_rules(self, formula, rules_memo):
+        key = (str(formula.root), repr(sorted(self.constants.items())))
+        try:
+            rules = self._rules[key]
+        except KeyError:
+            times = self.result.times
+            n = formula.root
+            with stage_timer(times, 'constants'):
+                n.replace_constants(self.constants)
+            print 80 * '-'
+            print 'RPN formula constants removed:\n', self.constants, '\n', n
+            with stage_timer(times, 'pnf'):
+                n = norm.pnf(n)
+            print 'Prenex RPN formula:\n', n
+            with stage_timer(times, 'normalization'):
+                m = norm.get_matrix(n)
+                clauses = norm.normalization(m)
+            with stage_timer(times, 'to_asp'):
+                rules = [norm.to_asp(i) for i in clauses]
+        rules_memo[key] = rules
+        return rules
 
     def generate_asp_rules(self):
+        self.result = SolveResult()
+        rules_memo = {}
         rules = []
-        n = self.formula.root
-        n.replace_constants(self.constants)
-        n = norm.pnf(n)
-        m = norm.get_matrix(n)
-        for i in norm.normalization(m):
-            rules.append(norm.to_asp(i))
+        for _, formula in self.parts:
+            rules.extend(self._get_part_rules(formula, rules_memo))
+        self._rules = rules_memo
         return rules
 
-    def solve(self, show=[]):
-        self._reset_solver()
+    def get_grounding_hot_spots(self):
+        """Grounds the current parts again in a new program, counting the
+        ground rules and atoms that come from each part.
 
-        n = self.formula.root
-        n.replace_constants(self.constants)
-        print 80 * '-'
-        print 'RPN formula constants removed:\n', self.constants, '\n', n
-        n = norm.pnf(n)
-        print 80 * '-'
-        print 'Prenex RPN formula:\n', n
-        print 80 * '-'
+        Returns:
+        A list of (tags, ground rules, ground atoms) tuples, one for every
+        part, with the parts that produce most rules first
+        """
+        self._join()
+        # The result of the last query is kept for its statistics
+        result = self.result
+        self.result = SolveResult()
+        observer = GroundingObserver()
+        try:
+            rules_memo = {}
+            part_rules = [(tag, self._get_part_rules(formula, rules_memo))
+                          for tag, formula in self.parts]
+            self._rules = rules_memo
+            self._observer = observer
+            self.solver = None
+            self._update_program(part_rules)
+            # clingo only ends the step when solving starts
+            observer.end_step()
+        finally:
+            self._observer = None
+            self.result = result
+        spots = [(tags, observer.rules[part_id],
+                  len(observer.atoms[part_id]))
+                 for part_id, tags in self._part_tags.iteritems()]
+        spots.sort(key=lambda spot: spot[1], reverse=True)
+        return spots
 
-        prog_name = 'base' + str(self.program_id)
-        m = norm.get_matrix(n)
-        for i in norm.normalization(m):
-            s = norm.to_asp(i)
+    def solve(self, show=[], on_model=None):
+        """Ground and solve the current formula.
+
+        Arguments:
+        show: Output predicates, as (name, arity) pairs (see set_show)
+        on_model: Optional callable, invoked with the solver after each new
+        stable model is stored
+        Returns:
+        A SolveResult, equal to 'SAT', 'UNSAT' or 'UNKNOWN'
+        """
+        self._stop_event.clear()
+        self._demand = None
+        self.set_show(show)
+        return self._solve(on_model)
+
+    def _solve(self, on_model):
+        self.stable_models = ModelStore()
+        self.models_found = 0
+        self.solve_time = None
+        self._exhausted = False
+        result = self.result = SolveResult()
+        self.clear_layout()
+
+        # A stored ground program skips normalization and grounding
+        ground_path = self.get_ground_path()
+        if ground_path is not None:
+            if self._load_ground_program(ground_path):
+                return self._solve_program(on_model, None)
+            if self.solver is None:
+                self._remove_ground_programs(ground_path)
+                self._observer = AspifWriter(ground_path)
+
+        # Parts that did not change since the last query are not normalized
+        # again
+        rules_memo = {}
+        part_rules = [(tag, self._get_part_rules(formula, rules_memo))
+                      for tag, formula in self.parts]
+        self._rules = rules_memo
+        rules = [r for _, part in part_rules for r in part]
+        result.rules = len(rules)
+        print 80 * '-'
+        for s in rules:
             print 'ASP RULE: ', s
-            self.solver.add(prog_name, [], s)
-        for s in show:
-            self.solver.add(prog_name, [], s)
 
-        self.solver.ground([(prog_name, [])])
+        # Complete results of the very same query are reused
+        # (counting and exporting store no models, so there is nothing to
+        # reuse)
+        key = None
+        if ((self.cache is not None) and not self.is_count_only() and
+            (self._model_writer is None)):
+            arguments = self.get_arguments()
+            arguments.extend('{0}={1}'.format(*a)
+                             for a in sorted(self.assumptions.items()))
+            if self.enum_mode == 'project':
+                arguments.extend('{0}/{1}'.format(*sig)
+                                 for sig in sorted(self.show))
+            key = self.cache.make_key(rules, arguments=arguments)
+            models = self.cache.get(key)
+            if models is not None:
+                print 'Stable models found in cache'
+                self.stable_models = models
+                self.models_found = len(models)
+                self._exhausted = True
+                if (on_model is not None) and (len(models) > 0):
+                    on_model(self)
+                result.cached = True
+                return self._finish_result()
+
+        try:
+            self._update_program(part_rules)
+        finally:
+            self._observer = None
+        return self._solve_program(on_model, key)
+
+    def _solve_program(self, on_model, key):
+        """Solves the grounded program, storing the result under key in the
+        cache if it is not None."""
+        result = self.result
+        if self._stop_event.is_set():
+            # Stopped while grounding
+            return self._finish_result()
+        assumptions = self._update_assumptions()
         print 80 * '-'
         print 'Stable models:'
-        result = self.solver.solve(yield_=True)
-        self.on_model(result)
-        retstr = 'Undefined'
-        if len(self.stable_models) > 0:
-            retstr = 'SAT'
+        start = time.time()
+        with self.solver.solve(yield_=True, assumptions=assumptions) as handle:
+            self._handle = handle
+            # stop() may have run before the handle was there to cancel
+            if self._stop_event.is_set():
+                handle.cancel()
+            self.on_model(handle, on_model)
+            self._handle = None
+        self.solve_time = time.time() - start
+        result.times['solve'] = self.solve_time
+        result.statistics = self.solver.statistics
+        if (key is not None) and self._exhausted:
+            self.cache.put(key, self.stable_models)
+        return self._finish_result()
+
+    def _finish_result(self):
+        result = self.result
+        result.models = self.models_found
+        if self.models_found > 0:
+            result.status = 'SAT'
+        elif self._exhausted:
+            result.status = 'UNSAT'
         else:
-            retstr = 'UNSAT'
-        print retstr
-        return retstr
+            # Stopped before the first model
+            result.status = 'UNKNOWN'
+        print 80 * '-'
+        print result.format()
+        print 'Models: {0} ({1:.1f} models/s)'.format(
+            self.models_found, self.get_throughput() or 0)
+        return result
+
+    def _update_program(self, part_rules):
+        """Brings the grounded program in line with the current parts.
+
+        Every part is grounded once in its own program part, with its rules
+        guarded by the external atom _part(part_id). The guards of parts
+        that no longer exist are released, so only new parts are grounded.
+
+        clingo does not let a later step define atoms again, and rules
+        using an atom without definition are dropped when grounded. So if a
+        new part defines a predicate used by a part grounded before, even a
+        released one, or an atom declared #external, or a new assumption is
+        made on such a predicate that no part defines, the program is
+        started over and every part is grounded again in a single step. The
+        atoms of new assumptions are declared #external in the same step as
+        the new parts.
+        """
+        # Projection directives cannot be taken back, a new set of output
+        # predicates needs a new program
+        projection = None
+        if self.enum_mode == 'project':
+            projection = frozenset(self.show)
+        reset = ((self.solver is None) or (projection != self._projection) or
+                 (self._ground_file is not None))
+        heads = set()
+        defined = set()
+        for _, rules in part_rules:
+            new = frozenset(rules) not in self._active
+            for r in rules:
+                names = get_predicates(r.split(':-')[0])
+                heads.update(names)
+                if new:
+                    defined.update(names)
+        if not reset:
+            defined.update(n for n in self.assumptions
+                           if (n not in self._externals) and
+                           (n not in heads))
+            if defined & (self._predicates | self._externals):
+                print 'Parts redefine grounded predicates, grounding again'
+                reset = True
+        if reset:
+            self._reset_solver()
+            self._projection = projection
+        self._heads = heads
+
+        active = {}
+        tags = {}
+        new_parts = []
+        for tag, rules in part_rules:
+            key = frozenset(rules)
+            if key in active:
+                tags[active[key]].append(tag)
+                continue
+            part_id = self._active.get(key)
+            if part_id is None:
+                part_id = self._next_part
+                self._next_part += 1
+                guard = str(self.get_guard(part_id))
+                # The whole part is parsed by clingo in a single call
+                program = [add_guard(r, guard) for r in rules]
+                program.append('#external {0}.'.format(guard))
+                with stage_timer(self.result.times, 'add'):
+                    self.solver.add('part' + str(part_id), [],
+                                    '\n'.join(program))
+                self.result.new_rules += len(rules)
+                for r in rules:
+                    self._predicates.update(get_predicates(r))
+                new_parts.append(part_id)
+            active[key] = part_id
+            tags[part_id] = [tag]
+        for key, part_id in self._active.iteritems():
+            if key not in active:
+                self.solver.release_external(self.get_guard(part_id))
+
+        programs = self._declare_externals()
+        programs.extend(('part' + str(i), []) for i in new_parts)
+        if programs and projection:
+            # Projection directives only apply to the atoms grounded with
+            # them, they are repeated in every step
+            prog_name = 'project' + str(self._next_part)
+            self.solver.add(prog_name, [], '\n'.join(
+                '#project {0}/{1}.'.format(*sig) for sig in projection))
+            programs.append((prog_name, []))
+        print 'Grounding {0} of {1} parts'.format(len(new_parts), len(active))
+        try:
+            with stage_timer(self.result.times, 'ground'):
+                self.solver.ground(programs)
+        except RuntimeError:
+            # The next query starts with a new program
+            self.solver = None
+            raise
+        for part_id in new_parts:
+            self.solver.assign_external(self.get_guard(part_id), True)
+        self._active = active
+        self._part_tags = tags
+
+    def _declare_externals(self):
+        """Adds a program part declaring #external the assumed atoms that
+        are not yet, and that no part defines.
+
+        Returns:
+        A list with the program part to ground, if any
+        """
+        new_externals = [n for n in self.assumptions
+                         if (n not in self._externals) and
+                         (n not in self._heads)]
+        if not new_externals:
+            return []
+        prog_name = 'whatif' + str(len(self._externals))
+        self.solver.add(prog_name, [], '\n'.join(
+            '#external {0}.'.format(name) for name in new_externals))
+        self._externals.update(new_externals)
+        return [(prog_name, [])]
+
+    def _update_assumptions(self):
+        """Assigns the externals of the assumed atoms.
+
+        Returns:
+        The assumption literals for the next solve call
+        """
+        # Externals without an assumption go back to their default value,
+        # they have no rules. Assumed atoms with rules are only fixed by the
+        # solve assumptions.
+        for name in self._externals:
+            value = self.assumptions.get(name, False)
+            self.solver.assign_external(clingo.Function(name), value)
+        return [(clingo.Function(name), value)
+                for name, value in self.assumptions.iteritems()]
+
+    def check_interpretation(self, atoms):
+        """Checks whether a set of atoms is a stable model of the current
+        parts, under the current assumptions.
+
+        Every atom of the ground program is fixed, true or false, with a
+        solve assumption, so a single solve call answers, however many
+        other models there are.
+
+        Arguments:
+        atoms: Ground atoms, as a string (see split_atoms) or as a list of
+        clingo.Symbol
+        Returns:
+        True if the atoms are a stable model
+        Raises:
+        RuntimeError if an atom cannot be parsed
+        """
+        if isinstance(atoms, basestring):
+            atoms = [clingo.parse_term(a) for a in split_atoms(atoms)]
+        candidate = set(atoms)
+        self._join()
+        self.result = SolveResult()
+        ground_path = self.get_ground_path()
+        if (ground_path is None) or not self._load_ground_program(ground_path):
+            rules_memo = {}
+            part_rules = [(tag, self._get_part_rules(formula, rules_memo))
+                          for tag, formula in self.parts]
+            self._rules = rules_memo
+            self._update_program(part_rules)
+        assumptions = self._update_assumptions()
+        program_atoms = set(a.symbol for a in self.solver.symbolic_atoms
+                            if a.symbol.name != GUARD)
+        if not candidate <= program_atoms:
+            print 'Atoms not in the program:', ' '.join(
+                str(a) for a in candidate - program_atoms)
+            return False
+        assumptions.extend((a, a in candidate) for a in program_atoms)
+        with self.solver.solve(yield_=True, assumptions=assumptions) as handle:
+            for m in handle:
+                print 'Stable model:', m
+                return True
+        return False
+
+    def get_unsat_core(self):
+        """Finds the parts responsible for the current parts having no stable
+        model, under the current assumptions.
+
+        The guard _part(part_id) of every part is left free and assumed
+        true. The parts are then dropped one at a time, keeping those
+        without which there is still no model, so the core is minimal. With
+        the unsatisfiable core API of recent clingo versions only the parts
+        of the cores clingo reports are tried, which are usually few.
+
+        It can be cancelled with stop(), when run with run_async.
+
+        Returns:
+        A list with the tags of the parts in the core, empty if the
+        assumptions alone have no model, or None if there are stable models
+        or it was stopped
+        """
+        self._join()
+        # The result of the last query is kept for its statistics
+        result = self.result
+        self.result = SolveResult()
+        try:
+            rules_memo = {}
+            part_rules = [(tag, self._get_part_rules(formula, rules_memo))
+                          for tag, formula in self.parts]
+            self._rules = rules_memo
+            self._update_program(part_rules)
+        finally:
+            self.result = result
+        base = self._update_assumptions()
+        guards = dict((part_id, self.get_guard(part_id))
+                      for part_id in self._part_tags)
+        for guard in guards.itervalues():
+            self.solver.assign_external(guard, None)
+        try:
+            core = self._solve_core(base, guards)
+        finally:
+            for guard in guards.itervalues():
+                self.solver.assign_external(guard, True)
+        if core is None:
+            return None
+        return [tag for part_id in core for tag in self._part_tags[part_id]]
+
+    def _solve_core(self, base, guards):
+        atoms = self.solver.symbolic_atoms
+
+        def in_core(part_ids, literals):
+            # clingo's cores are not minimal, but the parts outside them
+            # can go at once
+            if literals is None:
+                return part_ids
+            return [i for i in part_ids
+                    if atoms[guards[i]].literal in literals]
+
+        assumptions = base + [(g, True) for g in guards.itervalues()]
+        found, literals = self._find_model(assumptions)
+        if found is not False:
+            return None
+        # Deletion based minimization
+        core = in_core(sorted(guards), literals)
+        for part_id in list(core):
+            if part_id not in core:
+                continue
+            others = [i for i in core if i != part_id]
+            assumptions = base + [(g, i in others)
+                                  for i, g in guards.iteritems()]
+            found, literals = self._find_model(assumptions)
+            if found is None:
+                return None
+            if not found:
+                core = in_core(others, literals)
+        return core
+
+    def _find_model(self, assumptions):
+        """Solves until the first model, so that stop() can cancel it.
+
+        Returns:
+        True or False, whether there is a model, or None if it was stopped,
+        and the set of literals of the unsatisfiable core if there is no
+        model and clingo reports it
+        """
+        core = None
+        with self.solver.solve(yield_=True, assumptions=assumptions) as handle:
+            self._handle = handle
+            try:
+                if self._stop_event.is_set():
+                    handle.cancel()
+                found = any(True for _ in handle)
+                if ((not found) and hasattr(handle, 'core') and
+                    not self._stop_event.is_set()):
+                    handle.get()
+                    core = set(handle.core())
+            finally:
+                self._handle = None
+        if self._stop_event.is_set():
+            return None, None
+        return found, core
+
+    def export_models(self, path, show=[]):
+        """Enumerates the stable models of the current parts, writing each
+        one to a .jsonl or .csv file (see model_export) as soon as it is
+        found. Models are not stored, so memory does not grow with them.
+
+        Arguments:
+        path: File to write
+        show: Output predicates, as (name, arity) pairs (see set_show)
+        Returns:
+        A SolveResult
+        Raises:
+        ValueError if the enumeration mode is not 'all', since other modes
+        report consequences, projections or nothing instead of models
+        """
+        if self.enum_mode != 'all':
+            raise ValueError('Models are only exported in enumeration mode '
+                             'all, not {0}'.format(self.enum_mode))
+        self._join()
+        self._stop_event.clear()
+        self._demand = None
+        self.set_show(show)
+        with open(path, 'wb') as stream:
+            self._model_writer = model_export.get_writer(path, stream)
+            try:
+                return self._solve(None)
+            finally:
+                self._model_writer = None
 
-    def on_model(self, stablemodels):
+    def solve_async(self, show=[], on_model=None, on_finish=None):
+        """Run solve() in a worker thread.
+
+        Callbacks are invoked from the worker thread, so GUI code must post
+        them back to its own loop.
+
+        Arguments:
+        show: Output predicates, as (name, arity) pairs (see set_show)
+        on_model: Optional callable, invoked with the solver after each model
+        on_finish: Optional callable, invoked with the solver, the result
+        string and the raised exception (or None) when solving ends
+        """
+        self._join()
+        self._demand = self.lookahead + 1
+        self.set_show(show)
+        self.run_async(lambda: self._solve(on_model), on_finish)
+
+    def run_async(self, job, on_finish=None):
+        """Runs job in the worker thread, once the running query or job is
+        stopped, so that only one thread at a time drives the
+        clingo.Control.
+
+        Arguments:
+        job: Callable without arguments, usually a method of this solver
+        on_finish: Optional callable, invoked from the worker thread with
+        the solver, the value returned by job and the raised exception (or
+        None)
+        """
+        def run():
+            value, error = None, None
+            try:
+                value = job()
+            except Exception as e:
+                error = e
+            if on_finish is not None:
+                on_finish(self, value, error)
+
+        self._join()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=run, name='solver')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _join(self):
+        # Jobs call it from the worker thread itself
+        if (self.is_running() and
+            (threading.current_thread() is not self._thread)):
+            self.stop()
+            self._thread.join()
+
+    def stop(self):
+        """Stop an ongoing enumeration, keeping the models found so far."""
+        self._stop_event.set()
+        with self._demand_cond:
+            self._demand_cond.notify()
+        handle = self._handle
+        if handle is not None:
+            handle.cancel()
+
+    def on_model(self, stablemodels, callback=None):
+        # The search is suspended while the loop waits for more demand, so
+        # the next model is only computed when somebody asks for it.
         for m in stablemodels:
-            self.stable_models.append(str(m))
+            if self._stop_event.is_set():
+                break
+            self.models_found += 1
+            if self._model_writer is not None:
+                signature = self.stable_models.table.get_signature
+                self._model_writer.write(self.models_found, [
+                    s for s in m.symbols(atoms=True) if s.name != GUARD and
+                    (not self.show or signature(s) in self.show)])
+                continue
+            if self.is_count_only():
+                continue
+            if self.is_consequences():
+                # Each model refines the previous one, which can go
+                self.stable_models.clear()
+            symbols = [s for s in m.symbols(atoms=True) if s.name != GUARD]
+            if self._projection:
+                # Only the projection identifies the model
+                signature = self.stable_models.table.get_signature
+                symbols = [s for s in symbols
+                           if signature(s) in self._projection]
+            self.stable_models.append(symbols)
             print m
+            if callback is not None:
+                callback(self)
+            if self.is_consequences():
+                continue
+            with self._demand_cond:
+                while ((self._demand is not None) and
+                       (len(self.stable_models) >= self._demand) and
+                       not self._stop_event.is_set()):
+                    self._demand_cond.wait()
+        else:
+            self._exhausted = not self._stop_event.is_set()
 
     def parse_model(self, m):
         # Dict used to translate from arg position to anchor position
         anchor_codes = ['w', 'e', 'n', 's']
         nm = NameManager.Instance()
 
-        # nodes = {1: 'label1', 2: 'label2', ...}
-        # edges = [(1, 2, 'e'), ...]
+        # Atom nodes are named after the whole atom, so the same atom has the
+        # same node in every model
+        # nodes = {'atom p(a)': 'p', 'a': 'a', ...}
+        # edges = [('atom p(a)', 'a', 'w'), ...]
         nodes = {}
         edges = []
-        predicates = m.split()
-        for n, p in enumerate(predicates):
-            parts = p.split('(')
-            atom = parts[0]
-            terms = parts[1] if len(parts) > 1 else []
+        for symbol in self.get_shown_symbols(m):
+            atom = symbol.name
+            terms = [str(t) for t in symbol.arguments]
+            n = 'atom ' + str(symbol)
             nodes[n] = atom
             if terms:
-                terms = [t.strip(' )') for t in terms.split(',')]
                 atom_anchors = nm.get(atom).hook_points
                 term_anchors = [a for i, a in enumerate(anchor_codes)
                                 if atom_anchors[i]]
@@ -133,33 +1254,260 @@ class Solver(object):
         return nodes, edges
 
     def generate_graph(self, m):
+        """Draws the graph of a stored model (or of its index).
+
+        Returns:
+        The PNG image data, rendered in memory, or None if the graph is
+        too large and the model should be shown with get_model_table
+        """
+        return self.render_graph(m)[0]
+
+    def render_graph(self, m):
+        """Like generate_graph, but also returns the layout engine used, the
+        time it took and the layout_generation of the positions."""
+        with self._graph_lock:
+            start = time.time()
+            data, engine = self._generate_graph(m)
+            elapsed = time.time() - start
+            generation = self.layout_generation
+        print 'Graph drawn with {0} in {1:.3f} s'.format(engine, elapsed)
+        return data, engine, elapsed, generation
+
+    def layout_model(self, m):
+        """Computes the node positions of the graph of a stored model (or of
+        its index), without drawing it.
+
+        Returns:
+        A dict {node: ((x, y), label)} with positions in points, the list
+        of (node, node) edges, the layout engine used and the
+        layout_generation of the positions
+        """
+        with self._graph_lock:
+            nodes, edges = self.parse_model(m)
+            engine = self.get_layout_engine(len(nodes) + len(edges))
+            if engine == 'table':
+                # Drawing is cheap here, only the layout time matters
+                engine = 'sfdp'
+            if self.stable_layout:
+                self._update_layout(nodes, edges, engine)
+                positions = self._positions
+            else:
+                A = self._new_graph(engine)
+                for n, label in nodes.iteritems():
+                    A.add_node(n, label=label)
+                for e in edges:
+                    self._add_edge(A, e)
+                A.layout(engine)
+                positions = dict((n, n.attr['pos']) for n in A.nodes())
+            generation = self.layout_generation
+        graph = {}
+        for n, label in nodes.iteritems():
+            x, y = positions[n].rstrip('!').split(',')[:2]
+            graph[n] = ((float(x), float(y)), label)
+        return graph, [(e[0], e[1]) for e in edges], engine, generation
+
+    def get_layout_engine(self, size):
+        """Returns the layout engine for a graph of size nodes and edges."""
+        if self.layout_engine != 'auto':
+            return self.layout_engine
+        if size <= self.large_graph:
+            return 'dot'
+        if size <= self.huge_graph:
+            return 'sfdp'
+        return 'table'
+
+    def get_model_table(self, m):
+        """Returns the shown atoms of a stored model (or of its index) as
+        text, with a line for each predicate."""
+        rows = collections.OrderedDict()
+        for symbol in self.get_shown_symbols(m):
+            terms = ','.join(str(t) for t in symbol.arguments)
+            rows.setdefault(symbol.name, []).append(
+                '({0})'.format(terms) if terms else '')
+        return '\n'.join('{0} {1}'.format(name, ' '.join(args)).strip()
+                          for name, args in rows.iteritems())
+
+    def clear_layout(self):
+        """Forgets the node positions of the stable layout."""
+        self._union_nodes = {}
+        self._union_edges = set()
+        self._positions = {}
+        self._union_engine = None
+        self.layout_generation += 1
+
+    @staticmethod
+    def _new_graph(engine='dot'):
         A = pgv.AGraph()
         A.graph_attr['size'] = (10, 10)
         A.graph_attr['pad'] = 1
-        A.graph_attr['splines'] = 'spline'
-        A.graph_attr['overlap'] = 'false'
+        if engine == 'dot':
+            A.graph_attr['splines'] = 'spline'
+            A.graph_attr['overlap'] = 'false'
+        else:
+            # Spline routing and overlap removal dominate the time on large
+            # graphs, straight edges are much cheaper
+            A.graph_attr['splines'] = 'false'
+            A.graph_attr['overlap'] = 'prism'
         A.node_attr['shape'] = 'none'
         A.node_attr['font'] = 'Roboto'
         A.node_attr['fontsize'] = 16
         A.node_attr['width'] = 0
         A.node_attr['height'] = 0
+        return A
+
+    @staticmethod
+    def _add_edge(A, e, **attrs):
+        if e[2] == 'w':
+            A.add_edge(e[1], e[0], headport=e[2], **attrs)
+        else:
+            A.add_edge(e[0], e[1], tailport=e[2], **attrs)
 
+    def _update_layout(self, nodes, edges, engine):
+        """Adds the nodes and edges of a model to the union graph.
+
+        The first model, or the first one after the layout engine setting
+        changes, lays out the whole union with engine. The new nodes of
+        later models are placed by neato, with the other nodes pinned, so
+        that the nodes already drawn do not move.
+        """
+        self._union_nodes.update(nodes)
+        self._union_edges.update(edges)
+        new = [n for n in nodes if n not in self._positions]
+        if self._positions and (self._union_engine == self.layout_engine):
+            if not new:
+                return
+            U = self._new_graph('neato')
+            U.graph_attr['notranslate'] = 'true'
+            for n, label in self._union_nodes.iteritems():
+                U.add_node(n, label=label)
+                if n in self._positions:
+                    U.get_node(n).attr['pos'] = self._positions[n] + '!'
+            for e in self._union_edges:
+                self._add_edge(U, e)
+            # -s reads the positions in points, as they are written
+            U.layout('neato', args='-s')
+            for n in new:
+                self._positions[n] = U.get_node(n).attr['pos']
+            print 'Union layout: {0} new nodes placed'.format(len(new))
+        else:
+            U = self._new_graph(engine)
+            for n, label in self._union_nodes.iteritems():
+                U.add_node(n, label=label)
+            for e in self._union_edges:
+                self._add_edge(U, e)
+            U.layout(engine)
+            self._union_engine = self.layout_engine
+            self._positions = dict((n, n.attr['pos']) for n in U.nodes())
+            print 'Union layout of {0} nodes'.format(len(self._positions))
+        self.layout_generation += 1
+
+    def _generate_graph(self, m):
         nodes, edges = self.parse_model(m)
+        engine = self.get_layout_engine(len(nodes) + len(edges))
+        if engine == 'table':
+            return None, engine
+        A = self._new_graph(engine)
+        if self.stable_layout:
+            self._update_layout(nodes, edges, engine)
         print 'Nodes:'
         for n in nodes:
             A.add_node(n, label=nodes[n])
             print n, 'label=', nodes[n]
         print 'Edges:'
         for e in edges:
+            self._add_edge(A, e)
             if e[2] == 'w':
-                A.add_edge(e[1], e[0], headport=e[2])
                 print e[1], '--', e[0], ':', e[2]
             else:
-                A.add_edge(e[0], e[1], tailport=e[2])
                 print e[0], ':', e[2], '--', e[1]
 
+        if self.stable_layout:
+            # Every node of the union is placed at its position, the ones not
+            # in this model are hidden, so the picture does not move. neato
+            # -n2 keeps the positions and only routes the edges.
+            for n in self._union_nodes:
+                if n not in nodes:
+                    A.add_node(n, label=self._union_nodes[n], style='invis')
+                A.get_node(n).attr['pos'] = self._positions[n]
+            return A.draw(format='png', prog='neato', args='-n2'), engine
+
         # Possible values: neato, dot, twopi, circo, fdp, nop, wc, acyclic,
         # gvpr, gvcolor, ccomps, sccmap, tred, sfdp.
-        A.layout('dot')
-        A.draw('##graphviz-output##.png')
-        print "Wrote ##graphviz-output##.png"
+        A.layout(engine)
+        return A.draw(format='png'), engine
+
+
+class SolverTest(unittest.TestCase):
+
+    def get_models(self, solver):
+        solver.solve()
+        return sorted(' '.join(sorted(str(s) for s in
+                                      solver.get_shown_symbols(m)))
+                      for m in solver.get_models())
+
+    def test_edit_part(self):
+        solver = Solver()
+        # q > p, q | -q
+        solver.set_parts([('a', 'q p >'), ('b', 'q q - |')])
+        self.assertEqual(self.get_models(solver), ['', 'p q'])
+        # The new part defines p again: r > p, r | -r
+        solver.set_parts([('a', 'r p >'), ('b', 'q q - |'),
+                          ('c', 'r r - |')])
+        self.assertEqual(self.get_models(solver),
+                         ['', 'p q r', 'p r', 'q'])
+        # Only a constraint is added, the program is extended
+        solver.set_parts([('a', 'r p >'), ('b', 'q q - |'),
+                          ('c', 'r r - |'), ('d', 'q - /f >')])
+        self.assertEqual(self.get_models(solver), ['p q r', 'q'])
+
+    def test_assumption(self):
+        solver = Solver()
+        # p > q
+        solver.set_parts([('a', 'p q >')])
+        self.assertEqual(self.get_models(solver), [''])
+        solver.set_assumption('p', True)
+        self.assertEqual(self.get_models(solver), ['p q'])
+        solver.set_assumption('p', None)
+        self.assertEqual(self.get_models(solver), [''])
+
+    def test_assumption_on_defined_atom(self):
+        solver = Solver()
+        solver.set_parts([('a', 'a')])
+        solver.set_assumption('a', True)
+        self.assertEqual(self.get_models(solver), ['a'])
+        solver.set_assumption('a', False)
+        self.assertEqual(self.get_models(solver), [])
+        solver.set_assumption('a', None)
+        self.assertEqual(self.get_models(solver), ['a'])
+
+    def test_grounding_hot_spots(self):
+        solver = Solver()
+        # q > p, q | -q
+        solver.set_parts([('a', 'q p >'), ('b', 'q q - |')])
+        spots = solver.get_grounding_hot_spots()
+        self.assertEqual(sorted(tags for tags, _, _ in spots),
+                         [['a'], ['b']])
+        for tags, rules, atoms in spots:
+            self.assertTrue(rules > 0)
+
+    def test_unsat_core(self):
+        solver = Solver()
+        # a, b, not a, c | -c
+        solver.set_parts([('A', 'a'), ('B', 'b'), ('C', 'a /f >'),
+                          ('D', 'c c - |')])
+        self.assertEqual(solver.solve(), 'UNSAT')
+        self.assertEqual(sorted(solver.get_unsat_core()), ['A', 'C'])
+
+    def test_projection(self):
+        solver = Solver(enum_mode='project')
+        solver.set_parts([('a', 'a a - |'), ('b', 'b b - |')])
+        solver.solve(show=[('a', 0)])
+        self.assertEqual(solver.models_found, 2)
+        solver.set_parts([('a', 'a a - |'), ('b', 'b b - |'),
+                          ('c', 'c c - |')])
+        solver.solve(show=[('a', 0)])
+        self.assertEqual(solver.models_found, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
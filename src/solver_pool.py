@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2017 Carlos Pérez Ramil <c.pramil at udc.es>
+
+# This file is part of ASP-Graph.
+
+# ASP-Graph is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# ASP-Graph is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with ASP-Graph.  If not, see <http://www.gnu.org/licenses/>.
+
+"""SOLVER POOL MODULE
+
+Pool of long-lived worker processes that solve queries with clingo already
+loaded. Every session (an open graph, a user...) is always sent to the same
+worker, which keeps its Solver, and so its grounded program, between
+queries. Each worker accepts a bounded number of pending requests; when its
+queue is full, submit() blocks or raises Queue.Full. The workers are
+checked twice a second, one that dies fails its pending requests with a
+PoolError and is started again.
+
+Besides solving, a request can export the models to a file or check an
+interpretation (see submit). Running requests report the models found so
+far and can be stopped.
+
+The pool solves complete queries in batch, as benchmark.py does, and the
+queries of the GUI that do not show models: counting, exporting and
+checking interpretations. Queries that show models keep solving in the GUI
+process, in a thread per open graph (see Solver.solve_async), because they
+stream models on demand.
+"""
+
+import time
+import Queue
+import itertools
+import threading
+import collections
+import multiprocessing
+
+import clingo
+
+import solver as eg_solver
+from model_store import ModelStore
+
+def _watch(solver, request_id, results, stop, done):
+    """Reports the models found by solver until done is set, and stops it
+    while stop holds request_id (the query may not have started yet)."""
+    while not done.wait(0.2):
+        if stop.value == request_id:
+            solver.stop()
+        results.put((request_id, 'progress', solver.models_found))
+
+def _worker(requests, results, stop, max_sessions):
+    """Main loop of a worker process. A None request ends it."""
+    sessions = collections.OrderedDict()
+    for request in iter(requests.get, None):
+        (request_id, session, settings, parts, constants, assumptions, show,
+         query, argument) = request
+        try:
+            solver = sessions.pop(session, None)
+            if (solver is None) or (solver.get_settings() != settings):
+                solver = eg_solver.Solver(**settings)
+            sessions[session] = solver
+            while len(sessions) > max_sessions:
+                sessions.popitem(last=False)
+            solver.set_parts(parts, constants)
+            solver.set_assumptions(assumptions)
+            done = threading.Event()
+            watcher = threading.Thread(
+                target=_watch, name='watch',
+                args=(solver, request_id, results, stop, done))
+            watcher.daemon = True
+            watcher.start()
+            try:
+                if query == 'check':
+                    result = solver.check_interpretation(argument)
+                elif query == 'export':
+                    result = solver.export_models(argument, show=show)
+                else:
+                    result = solver.solve(show=show)
+            finally:
+                done.set()
+                watcher.join()
+            models = None
+            if query == 'solve':
+                # Symbols cross the process boundary as strings
+                models = [[str(s) for s in solver.get_shown_symbols(m)]
+                          for m in solver.get_models()]
+            results.put((request_id, 'done',
+                         (result, models, solver.models_found,
+                          solver.solve_time, solver.is_exhausted())))
+        except Exception as e:
+            results.put((request_id, 'error', '{0}: {1}'.format(
+                type(e).__name__, e)))
+
+
+class PoolError(Exception):
+    """Error raised by a worker while solving a request."""
+    pass
+
+
+class PoolResult(object):
+    """Pending result of a request submitted to a SolverPool.
+
+    While the request runs, models_found is the number of models found so
+    far.
+    """
+
+    def __init__(self, pool=None, request_id=None, callback=None):
+        self.result = None
+        self.models = None
+        self.models_found = 0
+        self.solve_time = None
+        self.exhausted = False
+        self.error = None
+        self._pool = pool
+        self._request_id = request_id
+        self._callback = callback
+        self._event = threading.Event()
+
+    def ready(self):
+        return self._event.is_set()
+
+    def is_exhausted(self):
+        return self.exhausted
+
+    def get_throughput(self):
+        """Returns the models found per second, or None if the request is
+        not finished."""
+        if not self.solve_time:
+            return None
+        return self.models_found / self.solve_time
+
+    def stop(self):
+        """Stops the request, keeping the models found so far."""
+        if self._pool is not None:
+            self._pool._stop(self._request_id)
+
+    def get(self, timeout=None):
+        """Waits for the request to finish.
+
+        Returns:
+        The SolveResult of the query, or whether the interpretation is a
+        stable model for a 'check' query, and a ModelStore with the shown
+        atoms of the models for a 'solve' query, None otherwise
+        """
+        if not self._event.wait(timeout):
+            raise multiprocessing.TimeoutError()
+        if self.error is not None:
+            raise PoolError(self.error)
+        return self.result, self.models
+
+    def _set(self, value, error):
+        if error is None:
+            (result, models, self.models_found, self.solve_time,
+             self.exhausted) = value
+            store = None
+            if models is not None:
+                symbols = {}
+                store = ModelStore()
+                for m in models:
+                    store.append(symbols.setdefault(s, clingo.parse_term(s))
+                                 for s in m)
+            self.result = result
+            self.models = store
+        else:
+            self.error = error
+        self._event.set()
+        if self._callback is not None:
+            self._callback(self)
+
+
+class SolverPool(object):
+    """Pool of solver worker processes.
+
+    Arguments:
+    processes -- number of worker processes (the number of CPUs by default)
+    max_pending -- pending requests accepted by each worker
+    max_sessions -- solver sessions kept by each worker
+    """
+
+    # Seconds between checks of the workers
+    check_interval = 0.5
+
+    def __init__(self, processes=None, max_pending=4, max_sessions=8):
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if processes < 1:
+            raise ValueError('Invalid number of processes: {0}'.format(
+                processes))
+        self.max_pending = max_pending
+        self.max_sessions = max_sessions
+        self._results = multiprocessing.Queue()
+        self._requests = [None] * processes
+        self._workers = [None] * processes
+        # Id of the request each worker has to stop
+        self._stops = [None] * processes
+        for i in range(processes):
+            self._start_worker(i)
+        # {request_id: (worker, PoolResult)}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._closing = False
+        self._ids = itertools.count()
+        self._collector = threading.Thread(target=self._collect,
+                                           name='solver-pool')
+        self._collector.daemon = True
+        self._collector.start()
+
+    def __len__(self):
+        return len(self._workers)
+
+    def _start_worker(self, i):
+        requests = multiprocessing.Queue(self.max_pending)
+        stop = multiprocessing.Value('l', -1)
+        worker = multiprocessing.Process(
+            target=_worker, name='solver-{0}'.format(i),
+            args=(requests, self._results, stop, self.max_sessions))
+        worker.daemon = True
+        worker.start()
+        self._requests[i] = requests
+        self._workers[i] = worker
+        self._stops[i] = stop
+
+    def _collect(self):
+        check_time = time.time() + self.check_interval
+        while True:
+            try:
+                item = self._results.get(True, self.check_interval)
+            except Queue.Empty:
+                item = ()
+            # A dead worker must not wait for the others to go quiet
+            if time.time() >= check_time:
+                self._check_workers()
+                check_time = time.time() + self.check_interval
+            if item is None:
+                break
+            if not item:
+                continue
+            request_id, kind, value = item
+            with self._lock:
+                if kind == 'progress':
+                    entry = self._pending.get(request_id)
+                else:
+                    entry = self._pending.pop(request_id, None)
+            # Requests of a worker that died were already failed
+            if entry is None:
+                continue
+            if kind == 'progress':
+                entry[1].models_found = value
+            elif kind == 'error':
+                entry[1]._set(None, value)
+            else:
+                entry[1]._set(value, None)
+
+    def _check_workers(self):
+        """Fails the pending requests of the workers that died, starting
+        them again unless the pool is closing."""
+        failed = []
+        with self._lock:
+            for i, worker in enumerate(self._workers):
+                if worker.is_alive() or (worker.exitcode == 0):
+                    continue
+                error = '{0} exited with code {1}'.format(worker.name,
+                                                          worker.exitcode)
+                print 'Solver pool:', error
+                for request_id, (j, pending) in self._pending.items():
+                    if j == i:
+                        del self._pending[request_id]
+                        failed.append((pending, error))
+                if not self._closing:
+                    self._start_worker(i)
+        for pending, error in failed:
+            pending._set(None, error)
+
+    def submit(self, session, parts, constants, settings={}, assumptions={},
+               show=[], block=True, timeout=None, query='solve',
+               argument=None, callback=None):
+        """Queues a query on the worker of session.
+
+        Arguments:
+        session -- hashable id, queries of a session go to the same worker
+        parts, constants -- as in Solver.set_parts, the tags are sent to the
+            worker and must be picklable
+        settings -- keyword arguments of Solver
+        assumptions -- as in Solver.set_assumptions
+        show -- (name, arity) signatures of the output predicates
+        block, timeout -- as in Queue.put, Queue.Full is raised when the
+            worker has too many pending requests
+        query -- 'solve', 'export' to write the models to the file argument
+            (see Solver.export_models), or 'check' whether the atoms in
+            argument are a stable model (see Solver.check_interpretation)
+        callback -- optional callable, invoked with the PoolResult from a
+            thread of the pool when the request finishes
+
+        Returns:
+        A PoolResult
+        """
+        if query not in ('solve', 'export', 'check'):
+            raise ValueError('Invalid query: {0}'.format(query))
+        defaults = eg_solver.Solver().get_settings()
+        defaults.update(settings)
+        request_id = next(self._ids)
+        pending = PoolResult(self, request_id, callback)
+        worker = hash(session) % len(self._workers)
+        with self._lock:
+            self._pending[request_id] = (worker, pending)
+            requests = self._requests[worker]
+        try:
+            requests.put(
+                (request_id, session, defaults, list(parts), dict(constants),
+                 dict(assumptions), list(show), query, argument),
+                block, timeout)
+        except Queue.Full:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            raise
+        return pending
+
+    def _stop(self, request_id):
+        with self._lock:
+            entry = self._pending.get(request_id)
+            if entry is not None:
+                self._stops[entry[0]].value = request_id
+
+    def solve(self, *args, **kwargs):
+        """Blocking version of submit, returns the result and the models."""
+        return self.submit(*args, **kwargs).get()
+
+    def close(self):
+        """Lets the workers finish their pending requests and stops them.
+        Requests of workers that die meanwhile fail."""
+        with self._lock:
+            self._closing = True
+        for requests, worker in zip(self._requests, self._workers):
+            while worker.is_alive():
+                try:
+                    requests.put(None, True, 0.5)
+                    break
+                except Queue.Full:
+                    pass
+        for worker in self._workers:
+            worker.join()
+        self._check_workers()
+        self._results.put(None)
+        self._collector.join()